@@ -0,0 +1,188 @@
+"""
+Measures the time and peak memory of each stage of Covy offline, against synthetic MOH and UC data served from a local HTTP server, with Slack replaced by a client that only records its calls.
+
+Run from the root of the repository:
+    python benchmarks/benchmark.py
+    python benchmarks/benchmark.py --quick
+"""
+
+import argparse, json, os, random, sys, tempfile, threading, time, tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+os.environ.setdefault("SLACK_TOKEN", "xoxb-benchmark")
+
+import slack_sdk
+from logging import disable, INFO
+
+MOH_SIZES = [100, 1000, 10000, 100000]
+UC_SIZES = [1, 10, 100, 500]
+QUICK_MOH_SIZES = [100, 1000]
+QUICK_UC_SIZES = [1, 10]
+
+CITIES = ["Christchurch", "Auckland", "Wellington", "Hamilton", "Tauranga", "Dunedin", "Rangiora", "Nelson", "Napier", "Whangārei"]
+PLACES = ["Countdown", "New World", "Pak'nSave", "Z Petrol Station", "Burger King", "Warehouse", "Library", "Pharmacy", "Medical Centre", "Bus Route"]
+STREETS = ["Riccarton Road", "Colombo Street", "Queen Street", "Lambton Quay", "Victoria Street", "Papanui Road", "Cashel Street", "Ilam Road"]
+EXPOSURE_TYPES = ["Casual", "Close", "Casual Plus"]
+UC_PLACES = ["Puaka-James Hight Library", "Erskine Building", "Ilam Village", "Rochester And Rutherford Hall", "Engineering Core", "Central Library", "Rehua Building"]
+
+
+def generate_moh_body(size, seed=0):
+    """Generates a MOH API response with the given number of items, of which roughly a tenth are in each city."""
+
+    rng = random.Random(seed)
+    items = []
+    for number in range(size):
+        day, hour = rng.randint(1, 28), rng.randint(0, 21)
+        city = rng.choice(CITIES)
+        items.append({"eventId": f"a0l4a0000004{number:06d}",
+                      "eventName": f"{rng.choice(PLACES)} {rng.choice(STREETS).split()[0]} {number}",
+                      "startDateTime": f"2021-10-{day:02d}T{hour:02d}:{rng.choice(['00', '15', '30', '45'])}:00.000Z",
+                      "endDateTime": f"2021-10-{day:02d}T{hour + 2:02d}:00:00Z",
+                      "publicAdvice": "Self-monitor for COVID-19 symptoms for 14 days after you were exposed. " * 3,
+                      "visibleInWebform": True,
+                      "publishedAt": "2021-10-29T05:32:49.542Z",
+                      "exposureType": rng.choice(EXPOSURE_TYPES),
+                      "location": {"latitude": f"{rng.uniform(-46.5, -35.0):.6f}",
+                                   "longitude": f"{rng.uniform(168.0, 178.0):.6f}",
+                                   "suburb": "Riccarton",
+                                   "city": city,
+                                   "address": f"{rng.randint(1, 999)} {rng.choice(STREETS)}, {city}"}})
+    return json.dumps({"items": items}).encode("utf-8")
+
+
+def generate_uc_body(tables, rows_per_table=8, seed=0):
+    """Generates a UC locations page with one table per day, alike the real page."""
+
+    rng = random.Random(seed)
+    html = ["<html><head><title>COVID-19 Locations of Interest</title></head><body><div class='content'>"]
+    for table in range(tables):
+        html.append(f"<h3>Day {table + 1}</h3><table><thead><tr><th>Location</th><th>Date</th><th>Time</th><th>Categorisation</th><th>Added</th></tr></thead><tbody>")
+        for row in range(rows_per_table):
+            html.append(f"<tr><td>\n{rng.choice(UC_PLACES)} room {table}-{row}\n</td><td>{table % 28 + 1} October 2021</td>"
+                        f"<td>{rng.randint(8, 11)}:00AM - {rng.randint(1, 5)}:00PM</td><td>{rng.choice(['close contact', 'casual contact'])}</td><td>{table % 28 + 2} Oct</td></tr>")
+        html.append("</tbody></table>")
+    html.append("</div></body></html>")
+    return "".join(html).encode("utf-8")
+
+
+class RecordingWebClient:
+    """Stands in for slack_sdk.WebClient, recording every call rather than sending it to Slack."""
+
+    calls = []
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __getattr__(self, method):
+        def record(**kwargs):
+            RecordingWebClient.calls.append(method)
+            if method == "users_list":
+                return {"members": [], "response_metadata": {}}
+            if method == "conversations_list":
+                return {"channels": [{"name": "covid_updates", "id": "C0000000000"}], "response_metadata": {}}
+            return {"ok": True}
+        return record
+
+
+def serve(bodies):
+    """Serves the bodies, a dictionary mapping each path to its bytes, from a local HTTP server in the background. Returns the base URL of the server."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = bodies.get(self.path)
+            if body is None:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def measure(function, setup=None):
+    """Runs a function once to warm it up, such that lazy imports and caches are not counted, then again to time it, and again under tracemalloc to find its peak memory. The setup function is run before each, and its result is passed to the function."""
+
+    argument = setup() if setup else None
+    function(argument)
+
+    argument = setup() if setup else None
+    started_at = time.perf_counter()
+    function(argument)
+    elapsed = time.perf_counter() - started_at
+
+    argument = setup() if setup else None
+    tracemalloc.start()
+    function(argument)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--quick", action="store_true", help="Only run the smallest sizes.")
+    arguments = parser.parse_args()
+    moh_sizes = QUICK_MOH_SIZES if arguments.quick else MOH_SIZES
+    uc_sizes = QUICK_UC_SIZES if arguments.quick else UC_SIZES
+
+    # Replace Slack before anything creates a client
+    slack_sdk.WebClient = RecordingWebClient
+    import covy, fetch, notifications, slack
+    from changes import Change, NEW_STATUS
+    from records import UcLocation
+    slack.CLIENT = RecordingWebClient()
+    notifications.COALESCE_SECONDS = 0
+    # Every poll should reach the local server, rather than reuse a body cached by an earlier poll
+    fetch.RESPONSE_CACHE_DIRECTORY = None
+    disable(INFO)
+
+    bodies = {f"/moh/{size}": generate_moh_body(size) for size in moh_sizes}
+    bodies.update({f"/uc/{size}": generate_uc_body(size) for size in uc_sizes})
+    base_url = serve(bodies)
+
+    # Every store is kept in a temporary directory, which is removed once the run is over
+    results = []
+    with tempfile.TemporaryDirectory(prefix="covy-benchmark-") as directory:
+        def fresh_state(name, url):
+            """Points the source at the local server, with an empty store, no remembered responses and no parsed UC tables, so that every row is new."""
+            covy.SOURCES[name] = covy.SOURCES[name]._replace(url=url)
+            covy.STORE_FILEPATH = os.path.join(directory, f"{time.monotonic_ns()}.db")
+            covy.UC_TABLE_CACHE = {}
+            fetch.LAST_RESPONSES.clear()
+
+        for size in moh_sizes:
+            url = f"{base_url}/moh/{size}"
+            moh_rows = covy.parse_moh_locations(covy.fetch_moh_locations(url))
+            changes = [Change(NEW_STATUS, row) for row in moh_rows]
+
+            results.append(("update_moh_locations (all new)", f"{size} items", measure(lambda _: covy.update_moh_locations(), lambda: fresh_state("moh", url))))
+            results.append(("update_moh_locations (unchanged)", f"{size} items", measure(lambda _: covy.update_moh_locations())))
+            results.append(("check_for_changes", f"{len(moh_rows)} rows", measure(lambda _: covy.check_for_changes(moh_rows, "moh", covy.MohLocation, covy.MOH_KEY_COLUMNS, covy.MOH_COLUMNS), lambda: fresh_state("moh", url))))
+            results.append(("render_moh_changes", f"{len(changes)} rows", measure(lambda _: covy.render_moh_changes(changes))))
+
+        for size in uc_sizes:
+            url = f"{base_url}/uc/{size}"
+            results.append(("update_uc_locations (all new)", f"{size} tables", measure(lambda _: covy.update_uc_locations(), lambda: fresh_state("uc", url))))
+            results.append(("update_uc_locations (unchanged)", f"{size} tables", measure(lambda _: covy.update_uc_locations())))
+            uc_changes = [Change(NEW_STATUS, UcLocation._make(row)) for row in covy.extract_uc_locations(bodies[f"/uc/{size}"])]
+            results.append(("render_uc_changes", f"{len(uc_changes)} rows", measure(lambda _: covy.render_uc_changes(uc_changes))))
+
+        notifications.flush()
+
+    print(f"{'Stage':<36}{'Size':>16}{'Time (ms)':>14}{'Peak (MiB)':>14}")
+    for stage, size, (elapsed, peak) in results:
+        print(f"{stage:<36}{size:>16}{elapsed * 1000:>14.1f}{peak / 2 ** 20:>14.2f}")
+    print(f"\nRecorded Slack calls: {len(RecordingWebClient.calls)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+import json, mmap, os, stat, time
+from contextlib import contextmanager
+from fcntl import flock, LOCK_EX, LOCK_SH, LOCK_UN
+from hashlib import sha1
+
+CHUNK_SIZE = 64 * 1024
+
+
+class CachedResponse:
+    """Stands in for the response of a source, reading the body from the shared cache through a memory map rather than holding a copy of it."""
+
+    def __init__(self, body, metadata):
+        self.body = body
+        self.metadata = metadata
+        self.status_code = 200
+        self.headers = metadata["headers"]
+        self.digest = metadata["digest"]
+        self.size = metadata["size"]
+
+    @property
+    def content(self):
+        # The memory map itself is given rather than a copy, which can be searched with a regular expression or sliced like bytes
+        return self.body
+
+    def iter_content(self, chunk_size=CHUNK_SIZE):
+        for start in range(0, len(self.body), chunk_size):
+            yield self.body[start:start + chunk_size]
+
+    def json(self):
+        return json.loads(self.body[:])
+
+    def close(self):
+        if isinstance(self.body, mmap.mmap):
+            self.body.close()
+
+
+def get_cached(directory, url, ttl_seconds, download):
+    """
+    Retrieves the body of a URL through a cache on disk that is shared by every process on the host. A fresh entry is reused as is. Otherwise only one process downloads the URL while the others wait on a file lock, and then reuse what it downloaded.
+
+    Parameters
+    ----------
+    directory: String
+        The directory the cache is kept in, which is created if it does not exist. It must belong to the current user and not be writable by anyone else, as every process that uses it trusts what it holds.
+    url: String
+        The URL to retrieve.
+    ttl_seconds: Float
+        How long an entry is fresh for after it was downloaded or revalidated.
+    download: Function
+        Called with the metadata of the cached entry (or None) to request the URL. It returns a streamed requests.Response, or None if the server replied that the cached entry is still current.
+
+    Returns
+    -------
+    response: CachedResponse
+        The cached body, along with the headers, digest and size of the response it came from.
+
+    """
+
+    make_private_directory(directory)
+    key = sha1(url.encode("utf-8")).hexdigest()
+    body_path, metadata_path = os.path.join(directory, f"{key}.body"), os.path.join(directory, f"{key}.json")
+
+    with locked(os.path.join(directory, f"{key}.lock"), LOCK_SH):
+        metadata = read_metadata(metadata_path)
+        if is_fresh(metadata, ttl_seconds):
+            return open_entry(body_path, metadata)
+
+    # Only one process may download at a time, and any that were waiting reuse its entry rather than downloading it again
+    with locked(os.path.join(directory, f"{key}.lock"), LOCK_EX):
+        metadata = read_metadata(metadata_path)
+        if is_fresh(metadata, ttl_seconds):
+            return open_entry(body_path, metadata)
+
+        response = download(metadata)
+        if response is None:
+            metadata["fetched_at"] = time.time()
+        else:
+            metadata = write_body(body_path, response)
+        write_metadata(metadata_path, metadata)
+        return open_entry(body_path, metadata)
+
+
+def make_private_directory(directory):
+    """Create the cache directory so that only the current user can use it, refusing to use one that was made by anyone else or that others can write to"""
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    status = os.stat(directory)
+    if status.st_uid != os.getuid() or status.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise PermissionError(f"The response cache {directory} belongs to another user or can be written to by others")
+
+
+@contextmanager
+def locked(filepath, operation):
+    """Holds a shared or exclusive lock on a file within the with block."""
+    with open(filepath, "a") as lock_file:
+        flock(lock_file, operation)
+        try:
+            yield
+        finally:
+            flock(lock_file, LOCK_UN)
+
+
+def is_fresh(metadata, ttl_seconds):
+    """Check whether a cached entry was downloaded or revalidated within the last ttl_seconds"""
+    return metadata != None and time.time() - metadata["fetched_at"] < ttl_seconds
+
+
+def read_metadata(filepath):
+    """Read the metadata of a cached entry, or None if the URL has not been cached yet"""
+    try:
+        with open(filepath, encoding="utf-8") as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def write_metadata(filepath, metadata):
+    """Replace the metadata of a cached entry in one step, so that it is never seen half written"""
+    with open(f"{filepath}.tmp", "w", encoding="utf-8") as file:
+        json.dump(metadata, file)
+    os.replace(f"{filepath}.tmp", filepath)
+
+
+def write_body(filepath, response):
+    """Write a streamed response to the cache chunk by chunk, hashing it on the way, and return the metadata of the new entry"""
+
+    digest, size = sha1(), 0
+    with open(f"{filepath}.tmp", "wb") as file:
+        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+            digest.update(chunk)
+            size += len(chunk)
+            _ = file.write(chunk)
+    response.close()
+
+    # Any process still reading the old body keeps its memory map of it, as replacing the file does not change the old one
+    os.replace(f"{filepath}.tmp", filepath)
+    return {"fetched_at": time.time(), "digest": digest.hexdigest(), "size": size,
+            "headers": {name: response.headers[name] for name in ("ETag", "Last-Modified", "Content-Type") if name in response.headers}}
+
+
+def open_entry(filepath, metadata):
+    """Memory map the body of a cached entry, such that every process reading it shares the same pages"""
+    if metadata["size"] == 0:
+        return CachedResponse(b"", metadata)
+    with open(filepath, "rb") as file:
+        return CachedResponse(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ), metadata)
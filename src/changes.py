@@ -0,0 +1,78 @@
+from collections import namedtuple
+from hashlib import sha1
+
+NEW_STATUS = "New Location"
+MODIFIED_STATUS = "Modified Location"
+REMOVED_STATUS = "Removed Location"
+
+# A changed row, where the row holds the current values of new and modified rows and the previous values of removed rows. Modified rows also hold the row they replaced as previous.
+Change = namedtuple("Change", ["status", "row", "previous"], defaults=[None])
+
+
+def fingerprint(row, columns):
+    """
+    Generates a stable fingerprint for a row of location data, such that the same row scraped at different times will always produce the same fingerprint.
+
+    Parameters
+    ----------
+    row: Named Tuple
+        A row of location data, such as a records.MohLocation, with an attribute for each column.
+    columns: List of Strings
+        The column names to include in the fingerprint, in the order they should be hashed.
+
+    Returns
+    -------
+    fingerprint: String
+        A hexadecimal SHA-1 digest of the row's values in the given columns.
+
+    """
+
+    # Use a unit separator between values so that ("ab", "c") and ("a", "bc") do not collide
+    return sha1("\x1f".join(str(getattr(row, column)) for column in columns).encode("utf-8")).hexdigest()
+
+
+def find_changes(previous_rows, current_rows, key_columns, columns):
+    """
+    Compares two snapshots of locations of interest and reports which rows are new, modified or removed. Rows are matched by their fingerprint using set differences, so the work grows linearly with the number of rows rather than with the product of changed and total rows.
+
+    Parameters
+    ----------
+    previous_rows: List of Named Tuples
+        The rows from the last scrape, such as records.MohLocation, with an attribute for each column.
+    current_rows: List of Named Tuples
+        The rows from the current scrape, in the same format as previous_rows.
+    key_columns: List of Strings
+        The columns that identify an event, e.g. the place and address. A row that disappeared and a row that appeared with the same key are reported as a single modified row.
+    columns: List of Strings
+        All of the columns to compare, which must include the key_columns.
+
+    Returns
+    -------
+    changes: List of Changes
+        A Change for every changed row, holding its status and row, and for modified rows the row it replaced.
+
+    """
+
+    previous_fingerprints = {fingerprint(row, columns): row for row in previous_rows}
+    current_fingerprints = {fingerprint(row, columns): row for row in current_rows}
+
+    # Anything that exists in both snapshots is unchanged, so only the differences need any further work
+    removed_rows = [previous_fingerprints[key] for key in previous_fingerprints.keys() - current_fingerprints.keys()]
+    added_rows = [current_fingerprints[key] for key in current_fingerprints.keys() - previous_fingerprints.keys()]
+
+    # Group the removed rows by their event key so an added row can claim the row it replaced
+    removed_by_key = {}
+    for row in removed_rows:
+        removed_by_key.setdefault(tuple(getattr(row, column) for column in key_columns), []).append(row)
+
+    new_rows, modified_rows = [], []
+    for row in added_rows:
+        replaced_rows = removed_by_key.get(tuple(getattr(row, column) for column in key_columns))
+        if replaced_rows:
+            modified_rows.append(Change(MODIFIED_STATUS, row, replaced_rows.pop()))
+        else:
+            new_rows.append(Change(NEW_STATUS, row))
+
+    removed_rows = [Change(REMOVED_STATUS, row) for rows in removed_by_key.values() for row in rows]
+
+    return new_rows + modified_rows + removed_rows
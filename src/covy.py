@@ -1,228 +1,480 @@
-from requests import get
-from pandas import DataFrame, concat, read_csv
-from math import floor
-from os import remove
-from os.path import exists
-from time import localtime, sleep
-from textwrap import wrap
-from schedule import every, run_pending
-from bs4 import BeautifulSoup
+import os, re
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from contextlib import closing
 from datetime import datetime
+from hashlib import sha1
+from ijson import items_coro, sendable_list
+from threading import Lock
+from time import monotonic, sleep
+from math import floor
+from random import uniform
 from warnings import filterwarnings
 filterwarnings("ignore")
-from slack import post_message, post_files
+from notifications import queue_message, get_notification_stats
+from records import MohLocation, UcLocation
+from changes import find_changes, NEW_STATUS, MODIFIED_STATUS, REMOVED_STATUS
+from fetch import get_if_changed, mark_as_processed
+from store import connect, load_current_rows, save_changes
+from metrics import timed, increment, set_gauge, serve_metrics
 from logging import basicConfig, INFO, getLogger
 basicConfig(format='%(asctime)-35s %(message)s', level=INFO, datefmt='%a %d %b %Y, %I:%M:%S %p')
 logger = getLogger(__name__)
 
+# Each source starts at this interval, which then shortens after a change and backs off while nothing changes
 MINUTES_BETWEEN_SCRAPING = 10
+MIN_MINUTES_BETWEEN_SCRAPING = 2
+MAX_MINUTES_BETWEEN_SCRAPING = 30
+SCRAPING_BACKOFF_FACTOR = 1.5
+# A random delay added to every poll so that we do not hit the servers on the same second each time
+SCRAPING_JITTER_SECONDS = 30
+# The local port to serve the timings of each stage on, at /metrics for Prometheus and /metrics.json. If None, they are not served. Each Covy process on a host needs its own port, which can be set with the COVY_METRICS_PORT environment variable (where an empty value turns the metrics off).
+METRICS_PORT = int(os.getenv("COVY_METRICS_PORT", "9464") or 0) or None
 MOH_API_URL = "https://api.integration.covid19.health.nz/locations/v1/current-locations-of-interest"
 UC_URL = "https://www.canterbury.ac.nz/covid-19/locations/"
 
-CITY_OF_INTEREST = "Christchurch"
-LAST_MOH_LOCATIONS_FILEPATH = "last_moh_locations.csv"
-LAST_UC_LOCATIONS_FILEPATH = "last_uc_locations.csv"
+# The channels or users to tell about the locations of interest in each city or region, where a region is any name in MOH_REGIONS
+MOH_SUBSCRIPTIONS = {"Christchurch": ["#covid_updates"]}
+MOH_REGIONS = {}
+# Places that users want to hear about any location of interest within a radius of, added with register_point_of_interest. The index is only built (and numpy loaded) when it is first needed after a point was added, so that adding many points costs a single build.
+POINTS_OF_INTEREST = []
+PROXIMITY_INDEX = None
+PROXIMITY_INDEX_LOCK = Lock()
+NEARBY_GROUP = "Nearby"
+# The channels or users to tell about the locations of interest at the University of Canterbury
+UC_SUBSCRIPTIONS = ["#covid_updates"]
+# The MOH API gives times in UTC, so convert them to local time before they are shown
+TIMEZONE = "Pacific/Auckland"
+# If True, the MOH API response is parsed chunk by chunk and only the locations in the city of interest are kept in memory
+STREAM_MOH_LOCATIONS = True
+# Every location ever scraped is kept here, along with when it was first and last listed. Each Covy process on a host needs its own store, as a process that reads rows another has already saved finds no changes to notify its subscribers of. It can be set with the COVY_STORE_PATH environment variable.
+STORE_FILEPATH = os.getenv("COVY_STORE_PATH") or "covy.db"
+
+UC_COLUMNS = ["Location", "Date", "Time", "Categorisation", "Added"]
+# Each day on the UC page has its own table, and only the newest usually changes. The rows of every table are kept by the fingerprint of the table's HTML so the others are not parsed again.
+UC_TABLE_PATTERN = re.compile(rb"<table\b.*?</table\s*>", re.DOTALL | re.IGNORECASE)
+UC_TABLE_CACHE = {}
+UC_ENCODING = "utf-8"
+# The dates on the UC page are written out, e.g. '9 october 2021', sometimes alongside the day of the week
+UC_DATE_PATTERN = re.compile(r"(\d{1,2}) ([a-z]+) (\d{4})")
+MOH_COLUMNS = ["eventName", "address", "startDateTime", "endDateTime", "exposureType"]
+
+# The columns that identify the same event between scrapes, so that changed times or exposure types are reported as modifications
+MOH_KEY_COLUMNS = ["eventName", "address"]
+UC_KEY_COLUMNS = ["Location", "Date"]
+
+# Every source of locations of interest, which are all polled at the same time
+Source = namedtuple("Source", ["name", "description", "url", "fetch", "parse", "record", "key_columns", "columns", "notify", "timeout", "group"])
+SOURCES = {}
+SOURCE_TIMEOUT_SECONDS = 60
+POLLER = ThreadPoolExecutor(max_workers=8, thread_name_prefix="covy")
+RUNNING_SOURCES = set()
+RUNNING_SOURCES_LOCK = Lock()
+
+
+def update_source(source):
+    """Fetch, parse and key the rows of a source, then notify of any changes since the last time it was scraped. Returns True if there were changes."""
+
+    # Grab the current data, unless it is the same as the last time it was scraped
+    with timed("fetch", source.name):
+        response = source.fetch(source.url, timeout=source.timeout)
+    if response is None:
+        increment("covy_unchanged_polls_total", source=source.name)
+        return False
+
+    # Close the response once it is parsed, releasing its connection or the memory map of its cached body
+    try:
+        with timed("parse", source.name):
+            current_rows = source.parse(response)
+    finally:
+        response.close()
+    set_gauge("covy_rows", len(current_rows), source=source.name)
+
+    # Split the rows into the groups that are each compared and notified on their own, e.g. one per subscribed city
+    with timed("normalise", source.name):
+        groups = source.group(current_rows) if source.group != None else {None: current_rows}
+
+    # Compare against (and then replace) the locations from the last scrape
+    changed_groups = {}
+    with timed("diff", source.name):
+        for group, rows in groups.items():
+            changes = check_for_changes(rows, source.name if group == None else f"{source.name}:{group}", source.record, source.key_columns, source.columns)
+            if len(changes) > 0:
+                changed_groups[group] = changes
+            for status in (NEW_STATUS, MODIFIED_STATUS, REMOVED_STATUS):
+                increment("covy_changes_total", sum(change.status == status for change in changes), source=source.name, status=status)
+    mark_as_processed(source.url, response)
+
+    # The notify functions time their own rendering and notifying
+    for group, changes in changed_groups.items():
+        source.notify(changes, group)
+    return len(changed_groups) > 0
 
 
 def update_uc_locations():
     """Find changes in the University of Canterbury's database of locations of interest"""
-    
-    # Grab the html code from the webbsite and use BeautifulSoup to store all the information
-    soup = BeautifulSoup(get(UC_URL).text, "lxml")
-    
-    # List the correct amount of columns, as sometimes data rows are put as a table 'tr'
-    column_names = ['Location', 'Date', 'Time', 'Categorisation', 'Added']
-    # Each table relates to a seperate day, so find all tables in the html code
-    current_locations = DataFrame()
-    for table in soup.findAll("table"):
-        # Find all rows in this table, where the it is a 1D column
-        raw_rows = table.find_all("td")
-        # Set up empty lists to contain the reshaped and processed data
-        processed_rows = [[] for _ in range(len(raw_rows) // len(column_names))]
-        for index, raw_row in enumerate(raw_rows):
-            row_number = index // len(column_names) # relates to which row it should be on
-            value = raw_row.text.strip("\n").strip().replace("\n", " ") # strip new lines            
-            processed_rows[row_number].append(value.lower() if raw_row.text[0].isnumeric() else value.title())
-        current_locations = concat([current_locations, DataFrame(data=processed_rows, columns=column_names)])
-    current_locations.reset_index(drop=True, inplace=True)
-
-
-    if exists(LAST_UC_LOCATIONS_FILEPATH):
-        changed_locations = check_for_changes(current_locations, LAST_UC_LOCATIONS_FILEPATH)
-        if len(changed_locations) == 0:
-            # Break the program as no changes detected
-            return None
-    else:
-        # This is the first time running it and all current locations are new!
-        changed_locations = current_locations.copy()
-        changed_locations["Status"] = ["New Location"] * len(changed_locations)
-
-    # Save the current cases in the previous file spot to replace it
-    with open(LAST_UC_LOCATIONS_FILEPATH, "wb") as last_locations_file:
-        if len(current_locations) > 1:
-            current_locations.to_csv(last_locations_file, index=False)
-        else:
-            last_locations_file.close()
-            remove(LAST_UC_LOCATIONS_FILEPATH)
-
-    if len(changed_locations) > 1:
-        # Clean up the changed locations
-        changed_locations = changed_locations[["Status", "Location", "Date", "Time", "Categorisation", "Added"]]
-        changed_locations.reset_index(drop=True, inplace=True)
-
-        # Create the markdown file of the changed locations
-        changed_locations = wrap_dataframe_rows(changed_locations)
-        changed_locations = changed_locations.sort_values(by="Date", ascending=False).reset_index(drop=True)
-        with open("updated uc locations.md", "w", encoding="utf-8") as file:
-            _ = file.write(changed_locations.to_markdown(index=False, tablefmt="fancy_grid"))
-
-        # Notify
-        message = f"There has been an update in the locations of interest at the University of Canterbury. For further details, please refer to the <{UC_URL}|University of Canterbury's COVID website>."
-        post_message("#covid_updates", message_type="Information", identifier="Covid Locations of Interest Update", message=message)
-        post_files("#covid_updates", ["updated uc locations.md"], "", greet=False)
+    return update_source(SOURCES["uc"])
+
+
+def parse_uc_locations(response):
+    """Pull every row out of the location tables on the UC page"""
+    return [UcLocation._make(row) for row in extract_uc_locations(response.content)]
+
+
+def notify_uc_changes(changes, group=None):
+    """Post the changed UC locations to Slack as sections of the message, so that each subscriber needs a single post unless the changes overflow it"""
+
+    with timed("render", "uc"):
+        messages = render_uc_changes(changes)
+
+    # Notify
+    message = f"There has been an update in the locations of interest at the University of Canterbury. For further details, please refer to the <{UC_URL}|University of Canterbury's COVID website>."
+    with timed("notify", "uc"):
+        for subscriber in UC_SUBSCRIPTIONS:
+            queue_changes(subscriber, message, messages)
+
+
+def render_uc_changes(changes):
+    """Write a line for each changed UC location, latest date first, packed into the sections of as few messages as possible"""
+    from slack import escape_mrkdwn, pack_sections
+
+    changes = sorted(changes, key=lambda change: parse_uc_date(change.row.Date), reverse=True)
+    return pack_sections([f"*{change.status}:* *{escape_mrkdwn(change.row.Location)}* on {escape_mrkdwn(change.row.Date)}, {escape_mrkdwn(change.row.Time)}. "
+                          f"{escape_mrkdwn(change.row.Categorisation)}, added {escape_mrkdwn(change.row.Added)}." for change in changes])
+
+
+def parse_uc_date(date):
+    """Read the date of a UC location, so that they can be sorted by it. A date that cannot be read is given the earliest possible date."""
+    match = UC_DATE_PATTERN.search(date)
+    try:
+        return datetime.strptime(" ".join(match.groups()), "%d %B %Y")
+    except (AttributeError, ValueError):
+        return datetime.min
+
+
+def extract_uc_locations(html):
+    """Pull the rows out of every location table on the UC page, where each table relates to a seperate day. The page can be bytes or a buffer such as a memory map, of which only the tables are copied. Only the tables whose HTML has not been seen before are parsed, and tables that are no longer on the page are dropped from the cache."""
+    global UC_TABLE_CACHE
+
+    if isinstance(html, str):
+        html = html.encode(UC_ENCODING)
+
+    rows, table_cache, parsed_tables = [], {}, 0
+    for table_html in UC_TABLE_PATTERN.findall(html):
+        key = sha1(table_html).digest()
+        table_rows = table_cache.get(key, UC_TABLE_CACHE.get(key))
+        if table_rows is None:
+            table_rows = parse_uc_table(table_html)
+            parsed_tables += 1
+        table_cache[key] = table_rows
+        rows.extend(table_rows)
+
+    UC_TABLE_CACHE = table_cache
+    increment("covy_uc_tables_total", parsed_tables, outcome="parsed")
+    increment("covy_uc_tables_total", len(table_cache) - parsed_tables, outcome="reused")
+    return rows
+
+
+def parse_uc_table(table_html):
+    """Pull the rows out of the HTML of a single location table on the UC page"""
+    from lxml.html import fromstring, HTMLParser
+
+    # Find all cells in this table as a 1D column, as sometimes data rows are put as a table 'tr'
+    table = fromstring(table_html, parser=HTMLParser(encoding=UC_ENCODING))
+    raw_cells = [cell.text_content() for cell in table.xpath("descendant-or-self::td")]
+    raw_cells = raw_cells[:len(raw_cells) - len(raw_cells) % len(UC_COLUMNS)]
+
+    # Strip new lines, then lower case the dates and times and title case everything else
+    values = [raw_cell.strip().replace("\n", " ") for raw_cell in raw_cells]
+    values = [value.lower() if raw_cell[:1].isnumeric() else value.title() for raw_cell, value in zip(raw_cells, values)]
+
+    # Reshape the 1D column back into rows of the correct amount of columns
+    return list(zip(*[iter(values)] * len(UC_COLUMNS)))
 
 
 def update_moh_locations():
     """Find changes in the Ministry of Health's database of locations of interest"""
-    
-    # Query the API for current data
-    all_locations_of_interest = get(MOH_API_URL).json()["items"]
-
-    # The 'location' attribute is a nested dictionary, so add it to the global dictionary instead
-    locations_of_interest_in_city = [ location for location in all_locations_of_interest if location["location"]["city"] == CITY_OF_INTEREST]
-    _ = [ location.update(location["location"]) for location in  locations_of_interest_in_city ]
-
-    current_locations = DataFrame(locations_of_interest_in_city)
-    if len(current_locations) > 0:
-        current_locations = current_locations[["eventName", "address", "startDateTime", "endDateTime", "exposureType"]]
-    
-
-    if exists(LAST_MOH_LOCATIONS_FILEPATH): 
-        changed_locations = check_for_changes(current_locations, LAST_MOH_LOCATIONS_FILEPATH)
-        if len(changed_locations) == 0:
-            # Break the program
-            return None            
-    else:
-        # This is the first time running it and all current locations are new!
-        changed_locations = current_locations.copy()
-        changed_locations["Status"] = ["New Location"] * len(changed_locations)
-
-
-    # Save the current cases in the previous file spot to replace it
-    with open(LAST_MOH_LOCATIONS_FILEPATH, "wb") as last_locations_file:
-        if len(current_locations) > 1:
-            current_locations.to_csv(last_locations_file, index=False)
-        else:
-            last_locations_file.close()
-            remove(LAST_MOH_LOCATIONS_FILEPATH)
-
-    if len(changed_locations) > 1:
-        # Turn the nasty strings into datetime objects so that we can write a nice string of the date and times.
-        changed_locations["startDateTime"] = [datetime.strptime(value.replace("T", " ").replace("Z", ""), "%Y-%m-%d %H:%M:%S.%f") for value in changed_locations["startDateTime"]]
-        changed_locations["endDateTime"] = [datetime.strptime(value.replace("T", " ").replace("Z", ""), "%Y-%m-%d %H:%M:%S.%f") for value in changed_locations["endDateTime"]]
-        changed_locations["Date"] = [datetime.strftime(start_value, "%d/%m/%Y") for start_value in changed_locations["startDateTime"]]
-        changed_locations["Time"] = ["{} - {}".format(datetime.strftime(start_value, "%I:%M%p"), datetime.strftime(end_value, "%I:%M%p")).lower() for start_value, end_value in zip(changed_locations["startDateTime"], changed_locations["endDateTime"])]
-
-        # Clean up the changed locations
-        changed_locations = changed_locations[["Status", "eventName", "address", "Date", "Time", "exposureType"]]
-        changed_locations.rename(columns={"eventName":"Place", "address":"Address", "exposureType":"Exposure"}, inplace=True)
-        changed_locations.reset_index(drop=True, inplace=True)
-
-
-        # Create the markdown file of the changed locations
-        changed_locations = wrap_dataframe_rows(changed_locations)
-        changed_locations = changed_locations.sort_values(by="Date", ascending=False).reset_index(drop=True)
-        with open("updated moh locations.md", "w", encoding="utf-8") as file:
-            _ = file.write(changed_locations.to_markdown(index=False, tablefmt="fancy_grid"))
-
-        # Notify
-        message = f"There has been an update in the locations of interest for {CITY_OF_INTEREST}. For further details, please refer to the <https://www.health.govt.nz/covid-19-novel-coronavirus/covid-19-health-advice-public/covid-19-information-close-contacts/covid-19-contact-tracing-locations-interest| Ministry of Health's website>."
-        post_message("#covid_updates", message_type="Information", identifier="Covid Locations of Interest Update", message=message)
-        post_files("#covid_updates", ["updated moh locations.md"], "", greet=False)
-
-
-def check_for_changes(current_locations, previous_locations_fp):
-    """Assess the current_locations DataFrame against the previous_locations DataFrame, and return any changes in the current_locations DataFrame."""
-
-    # Open the previous file
-    with open(previous_locations_fp, "rb") as last_locations_file:
-        previous_locations = read_csv(last_locations_file)
-        last_locations_file.close()
-
-    if len(current_locations) == 0:
-        changed_locations = previous_locations[["eventName", "address", "startDateTime", "endDateTime", "exposureType"]]
-        changed_locations["Status"] = "Removed Location"
-        return changed_locations
-    
-    previous_locations = previous_locations[current_locations.columns]
-
-    # Test to see if the same as previous data
-    if not previous_locations.equals(current_locations):
-        # Find the overlaps which is changed_locations
-        changed_locations = concat([previous_locations, current_locations]).drop_duplicates(keep=False)
-        # Convert the old dataframess to numpy arrays to check if in them
-        current_locations_array = current_locations.to_numpy()
-        # Assess if the change is new or removed by seeing which old dataframe it is in
-        changed_locations["Status"] = ["New Location" for row in changed_locations.to_numpy() if row in current_locations_array]
-        changed_locations.sort_values("Status", inplace=True)
-        return changed_locations
-    
-    else:
-        # No updates found so send back empty DataFrame
-        return DataFrame()
-
-
-def wrap_dataframe_rows(changed_locations, width_limit=150):
-    """Enforce a strict width limit on a DataFrame such that it can be printed out nicely. If the width of the DataFrame is over the limit, then the largest column is halved untill the limit is met. It assumes all dtypes are strings. New line characters are inserted into the string to make the DataFrame reduce in width."""
-
-    while len(changed_locations.to_markdown(index=False).split("\n")[0]) >= width_limit:
-        column_line = changed_locations.to_markdown(index=False).split("\n")[0]
-        row_lengths = [len(col) for col in column_line.split("|")[1:-1]]
-        column_index = row_lengths.index(max(row_lengths))
-        column_name = changed_locations.columns[column_index]
-        # Split in half
-        halved_values = []
-        for value in changed_locations[column_name]:
-            words = wrap(value, floor(row_lengths[column_index]/2), break_long_words=True, break_on_hyphens=True, drop_whitespace=True)
-            final = ''
-            for word in words:
-                final += word + "\n"
-            halved_values.append(final[:-1])
-        changed_locations[column_name] = halved_values
+    return update_source(SOURCES["moh"])
 
-    return changed_locations
+
+def fetch_moh_locations(url, timeout=None):
+    """Query the API for current data, reading the body into a temporary file rather than memory if it is to be streamed"""
+    return get_if_changed(url, stream=STREAM_MOH_LOCATIONS, timeout=timeout)
+
+
+def parse_moh_locations(response):
+    """Keep the projected fields of the locations in any subscribed city from the MOH API response"""
+
+    cities = {city for subscription in MOH_SUBSCRIPTIONS for city in MOH_REGIONS.get(subscription, [subscription])}
+    index = get_proximity_index()
+    if STREAM_MOH_LOCATIONS:
+        return stream_moh_locations(response, cities, index)
+
+    all_locations_of_interest = response.json()["items"]
+    return [project_moh_location(location) for location in all_locations_of_interest if is_moh_location_wanted(location, cities, index)]
 
 
-def update():
-    """Attempt to find changes to the locations of interest at both the University of Canterbury's campus and in Chhristchurch according to the Ministry of Health."""
+def is_moh_location_wanted(location, cities, index=None):
+    """Check whether a location from the MOH API is in a subscribed city, or could be near a point of interest in the proximity index"""
+
+    if location["location"]["city"] in cities:
+        return True
+    if index is None:
+        return False
+    from proximity import might_be_near
+    latitude, longitude = read_coordinates(location)
+    return latitude != None and might_be_near(index, latitude, longitude)
+
+
+def read_coordinates(location):
+    """Read the latitude and longitude of a location from the MOH API, which are given as strings and are sometimes missing"""
     try:
-        update_uc_locations()
-        logger.info("Scraping successful for UC locations")
-    except Exception as error:
-        error_string = f"Scraping failed for UC locations due to: {error}"
-        logger.info(error_string)
-        post_message("#covid_updates", "Failure", "Covid Locations of Interest Update", message=error_string)
+        return float(location["location"]["latitude"]), float(location["location"]["longitude"])
+    except (KeyError, TypeError, ValueError):
+        return None, None
+
+
+def group_moh_locations(current_rows):
+    """Split the MOH locations by each subscribed city or region. Every subscription gets a group, even if it is empty, so that removed locations are still found."""
+
+    rows_by_city = {}
+    for row in current_rows:
+        rows_by_city.setdefault(row.city, []).append(row)
+
+    groups = {subscription: [row for city in MOH_REGIONS.get(subscription, [subscription]) for row in rows_by_city.get(city, [])] for subscription in MOH_SUBSCRIPTIONS}
+
+    # Any location that could be near a point of interest is kept in its own group, so that only new ones are measured
+    index = get_proximity_index()
+    if index != None:
+        from proximity import might_be_near
+        groups[NEARBY_GROUP] = [row for row in current_rows if row.latitude != None and might_be_near(index, row.latitude, row.longitude)]
+    return groups
+
+
+def notify_moh_changes(changes, group):
+    """Post the changed MOH locations of a city or region to Slack as sections of the message, rendering them once for all of its subscribers"""
+
+    if group == NEARBY_GROUP:
+        return notify_nearby_changes(changes)
+
+    with timed("render", "moh"):
+        messages = render_moh_changes(changes)
+
+    # Notify
+    message = f"There has been an update in the locations of interest for {group}. For further details, please refer to the <https://www.health.govt.nz/covid-19-novel-coronavirus/covid-19-health-advice-public/covid-19-information-close-contacts/covid-19-contact-tracing-locations-interest| Ministry of Health's website>."
+    with timed("notify", "moh"):
+        for subscriber in MOH_SUBSCRIPTIONS.get(group, []):
+            queue_changes(subscriber, message, messages)
+
+
+def render_moh_changes(changes):
+    """Write a line for each changed MOH location, latest date first, packed into the sections of as few messages as possible"""
+    from slack import escape_mrkdwn, pack_sections
+
+    # Turn the nasty strings into local datetimes so that we can write a nice string of the date and times.
+    changed_locations = add_moh_dates_and_times(changes_to_dataframe(changes, MOH_COLUMNS))
+    changed_locations = changed_locations.sort_values(by="Start", ascending=False)
+
+    return pack_sections([f"*{location.Status}:* *{escape_mrkdwn(location.eventName)}* ({escape_mrkdwn(location.address)}) on {location.Date}, {location.Time}. {escape_mrkdwn(location.exposureType)} exposure."
+                          for location in changed_locations.itertuples(index=False)])
+
 
+def queue_changes(subscriber, message, messages, identifier="Covid Locations of Interest Update"):
+    """Queue the message along with the sections of changes, posting it again with the next sections as many times as they need"""
+    for number, sections in enumerate(messages, start=1):
+        part = f" (part {number} of {len(messages)})" if len(messages) > 1 else ""
+        queue_message(subscriber, message_type="Information", identifier=identifier, message=message + part, sections=sections)
+
+
+def register_point_of_interest(name, latitude, longitude, radius_km, subscriber):
+    """Alert the subscriber (a channel or user) of any new location of interest within radius_km of the point, e.g. their home, work or campus. The proximity index is rebuilt the next time it is needed."""
+    global PROXIMITY_INDEX
+    with PROXIMITY_INDEX_LOCK:
+        POINTS_OF_INTEREST.append({"name": name, "latitude": latitude, "longitude": longitude, "radius_km": radius_km, "subscriber": subscriber})
+        PROXIMITY_INDEX = None
+
+
+def get_proximity_index():
+    """Build the proximity index of every point of interest if a point was added since it was last built, or give None if there are no points."""
+    global PROXIMITY_INDEX
+    with PROXIMITY_INDEX_LOCK:
+        if PROXIMITY_INDEX is None and len(POINTS_OF_INTEREST) > 0:
+            from proximity import build_index
+            PROXIMITY_INDEX = build_index([point["latitude"] for point in POINTS_OF_INTEREST], [point["longitude"] for point in POINTS_OF_INTEREST], [point["radius_km"] for point in POINTS_OF_INTEREST])
+        return PROXIMITY_INDEX
+
+
+def notify_nearby_changes(changes):
+    """Tell each subscriber about the new or modified locations of interest within the radius of their points of interest"""
+    from proximity import find_nearby
+    from slack import escape_mrkdwn, pack_sections
+
+    # Locations that are no longer listed are no risk, so only measure the distance to the others
+    changes = [change for change in changes if change.status != REMOVED_STATUS]
+    if len(changes) == 0:
+        return None
+
+    location_indexes, point_indexes, distances_km = find_nearby(get_proximity_index(), [change.row.latitude for change in changes], [change.row.longitude for change in changes])
+    changed_locations = add_moh_dates_and_times(changes_to_dataframe(changes, MOH_COLUMNS))
+
+    # Gather every match for each subscriber so they get one message
+    lines_by_subscriber = {}
+    for location_index, point_index, distance_km in zip(location_indexes, point_indexes, distances_km):
+        location, point = changed_locations.iloc[location_index], POINTS_OF_INTEREST[point_index]
+        line = (f"• *{escape_mrkdwn(location['eventName'])}* ({escape_mrkdwn(location['address'])}) on {location['Date']}, {location['Time']} is {distance_km:.1f} km from {escape_mrkdwn(point['name'])}. "
+                f"{location['Status']}, {escape_mrkdwn(location['exposureType'])} exposure.")
+        lines_by_subscriber.setdefault(point["subscriber"], []).append(line)
+
+    with timed("notify", "moh"):
+        for subscriber, lines in lines_by_subscriber.items():
+            queue_changes(subscriber, "There are locations of interest near you:", pack_sections(lines), identifier="Covid Locations of Interest Nearby")
+
+
+def stream_moh_locations(response, cities, index=None):
+    """Parse the MOH API response chunk by chunk, keeping only the projected fields of the locations in any of the cities or near a point of interest in the proximity index."""
+
+    # The items are pushed into the parser chunk by chunk and collected here as each one is completed
+    items = sendable_list()
+    parser = items_coro(items, "items.item")
+
+    locations_of_interest = []
+    for chunk in response.iter_content(chunk_size=64 * 1024):
+        parser.send(chunk)
+        locations_of_interest.extend(project_moh_location(location) for location in items if is_moh_location_wanted(location, cities, index))
+        del items[:]
+    parser.close()
+    return locations_of_interest
+
+
+def project_moh_location(location):
+    """Flatten a location from the MOH API into the fields that are kept, as the address, city and coordinates are within the nested 'location' attribute. The city and coordinates are only used to group and match the locations, and are not part of the compared columns."""
+    latitude, longitude = read_coordinates(location)
+    return MohLocation(location["eventName"], location["location"]["address"], location["startDateTime"], location["endDateTime"], location["exposureType"],
+                       location["location"]["city"], latitude, longitude)
+
+
+def add_moh_dates_and_times(changed_locations):
+    """Add the local Date and Time columns to a DataFrame of MOH locations, converting whole columns of the UTC timestamps at once. Timestamps are accepted with or without fractional seconds. The local start time is kept as the Start column, which the locations can be sorted by."""
+    from pandas import to_datetime
+
+    start_times = to_datetime(changed_locations["startDateTime"], utc=True, format="ISO8601").dt.tz_convert(TIMEZONE)
+    end_times = to_datetime(changed_locations["endDateTime"], utc=True, format="ISO8601").dt.tz_convert(TIMEZONE)
+
+    changed_locations = changed_locations.copy()
+    changed_locations["Start"] = start_times
+    changed_locations["Date"] = start_times.dt.strftime("%d/%m/%Y")
+    changed_locations["Time"] = (start_times.dt.strftime("%I:%M%p") + " - " + end_times.dt.strftime("%I:%M%p")).str.lower()
+    return changed_locations
+
+
+def check_for_changes(current_rows, source, record, key_columns, columns):
+    """Assess the current rows against the rows stored from the last scrape of the source, then save and return the Change of any new, modified or removed locations."""
+
+    with closing(connect(STORE_FILEPATH)) as connection:
+        previous_rows = load_current_rows(connection, source, record)
+        changes = find_changes(previous_rows, current_rows, key_columns, columns)
+        save_changes(connection, source, changes, columns)
+
+    return changes
+
+
+def changes_to_dataframe(changes, columns):
+    """Lay the changed rows out in a DataFrame with their Status, ready to be rendered. pandas is only loaded here, as it is only needed once there is something to notify."""
+    from pandas import DataFrame
+
+    changed_locations = DataFrame([[getattr(change.row, column) for column in columns] for change in changes], columns=columns)
+    changed_locations.insert(0, "Status", [change.status for change in changes])
+    return changed_locations
+
+
+def register_source(name, description, url, parse, record, key_columns, columns, notify, fetch=get_if_changed, timeout=SOURCE_TIMEOUT_SECONDS, group=None):
+    """Add a source of locations of interest to be polled. The fetch function is called with the url and a timeout and returns a response (or None if unchanged), parse turns the response into a list of rows of the record type (a named tuple from records), and notify is given the Changes of a group. If given, group splits the rows into a dictionary of groups that are each compared and notified on their own, otherwise every row is in the single group None."""
+    SOURCES[name] = Source(name, description, url, fetch, parse, record, key_columns, columns, notify, timeout, group)
+
+
+def update(names=None):
+    """Attempt to find changes to the locations of interest from the named sources (or every registered source if None) at the same time, such that a slow source does not hold up the others. Returns a dictionary of which sources had changes."""
+
+    # Skip any source that is still running from a previous cycle which overran its timeout
+    with RUNNING_SOURCES_LOCK:
+        sources = [source for name, source in SOURCES.items() if name not in RUNNING_SOURCES and (names is None or name in names)]
+        RUNNING_SOURCES.update(source.name for source in sources)
+
+    started_at = monotonic()
+    futures = {source.name: POLLER.submit(run_source, source) for source in sources}
+
+    changes = {}
+    for source in sources:
+        try:
+            changes[source.name] = futures[source.name].result(timeout=max(0, started_at + source.timeout - monotonic()))
+            logger.info(f"Scraping successful for {source.description}")
+        except Exception as error:
+            if isinstance(error, TimeoutError):
+                error = f"no response within {source.timeout} seconds"
+            changes[source.name] = False
+            error_string = f"Scraping failed for {source.description} due to: {error}"
+            logger.info(error_string)
+            queue_message("#covid_updates", "Failure", "Covid Locations of Interest Update", message=error_string)
+
+    return changes
+
+
+def run_source(source):
+    """Update a source in a worker thread, and mark it as no longer running once done."""
     try:
-        update_moh_locations()
-        logger.info("Scraping successful for MOH locations")
-    except Exception as error:
-        error_string = f"Scraping failed for MOH locations due to: {error}"
-        logger.info(error_string)
-        post_message("#covid_updates", "Failure", "Covid Locations of Interest Update", message=error_string)
+        return update_source(source)
+    finally:
+        with RUNNING_SOURCES_LOCK:
+            RUNNING_SOURCES.discard(source.name)
+
+
+def next_interval(interval, changed):
+    """Poll a source as often as allowed after it changes, and back off while it stays the same."""
+    if changed:
+        return MIN_MINUTES_BETWEEN_SCRAPING * 60
+    return min(interval * SCRAPING_BACKOFF_FACTOR, MAX_MINUTES_BETWEEN_SCRAPING * 60)
+
+
+def next_slot(slot, interval, now):
+    """Step a source's schedule forward by its interval from the last slot rather than from when the poll finished, so that the schedule does not drift. Any slots that were missed by an overrunning poll are skipped rather than run back to back."""
+    slot += interval
+    if slot <= now:
+        slot += interval * (floor((now - slot) / interval) + 1)
+    return slot
 
 
 def main():
-    # Schedule and perform the function for every minute
-    every(1).minutes.do(update)
+    if METRICS_PORT != None:
+        # Another process may already be serving on the port, which is no reason to stop polling
+        try:
+            serve_metrics(METRICS_PORT)
+        except OSError as error:
+            logger.warning(f"The metrics could not be served on port {METRICS_PORT} due to: {error}")
+
+    # Every source has its own interval and schedule of slots, and is polled at its slot plus some jitter
+    intervals = {name: MINUTES_BETWEEN_SCRAPING * 60 for name in SOURCES}
+    slots = {name: monotonic() for name in SOURCES}
+    deadlines = dict(slots)
+
     while True:
+        # Sleep until the next source is due, rather than checking the clock over and over
         print("Waiting...", end="\r")
-        if localtime().tm_min % MINUTES_BETWEEN_SCRAPING == 0:
-            print("Running!", end="\r")
-            # Then it's time to update!
-            run_pending()
-            print("Waiting...", end="\r")
-            sleep(61)
+        sleep(max(0, min(deadlines.values()) - monotonic()))
+
+        # Then it's time to update! The polls are waited on so they can never overlap.
+        print("Running!", end="\r")
+        due = [name for name, deadline in deadlines.items() if deadline <= monotonic()]
+        changes = update(due)
+        logger.info(f"Notifications so far: {get_notification_stats()}")
+
+        for name in due:
+            intervals[name] = next_interval(intervals[name], changes.get(name, False))
+            slots[name] = next_slot(slots[name], intervals[name], monotonic())
+            deadlines[name] = slots[name] + uniform(0, SCRAPING_JITTER_SECONDS)
+
+
+register_source("uc", "UC locations", UC_URL, parse_uc_locations, UcLocation, UC_KEY_COLUMNS, UC_COLUMNS, notify_uc_changes)
+register_source("moh", "MOH locations", MOH_API_URL, parse_moh_locations, MohLocation, MOH_KEY_COLUMNS, MOH_COLUMNS, notify_moh_changes, fetch=fetch_moh_locations, group=group_moh_locations)
 
 
 if __name__ == "__main__":
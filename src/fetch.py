@@ -0,0 +1,294 @@
+import json, os
+from functools import partial
+from hashlib import sha1
+from importlib.util import find_spec
+from os.path import join
+from random import uniform
+from tempfile import gettempdir, SpooledTemporaryFile
+from threading import Lock
+from time import monotonic, sleep
+from urllib.parse import urlsplit
+from requests import ConnectionError, Session, Timeout
+from requests.adapters import HTTPAdapter
+from metrics import increment
+
+# The validators and body hash of the last response that was fully processed, for each URL
+LAST_RESPONSES = {}
+# Responses are cached here and shared by every Covy process of the same user on the host, so that each URL is downloaded at most once per TTL however many are running. If None, every process downloads for itself. The directory is only readable by its user, so that no one else can plant responses in it. The cache relies on file locks, so it is None where they are not available, such as on Windows.
+RESPONSE_CACHE_DIRECTORY = join(gettempdir(), f"covy-responses-{os.getuid()}") if find_spec("fcntl") != None else None
+RESPONSE_CACHE_TTL_SECONDS = 60
+# Without the cache, a streamed body is hashed into a temporary file before it is parsed, which is only written to disk once it is larger than this
+SPOOL_MAX_BYTES = 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
+# One session is shared by every request, so that connections to each server are kept alive and reused between polls
+SESSION = None
+SESSION_LOCK = Lock()
+CONNECTION_POOL_SIZE = 8
+CONNECT_TIMEOUT_SECONDS = 5
+READ_TIMEOUT_SECONDS = 20
+
+# Requests that fail to connect, time out or get one of these statuses are retried after a jittered backoff
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+MAX_ATTEMPTS = 4
+RETRY_BASE_SECONDS = 0.5
+# Each request earns its URL this much of a retry and every retry spends one, so that a source which is down is not hammered with retries. The budget starts full.
+RETRY_BUDGET_RATIO = 0.2
+RETRY_BUDGET_MAX = 3
+RETRY_BUDGETS = {}
+RETRY_BUDGETS_LOCK = Lock()
+
+
+def get_if_changed(url, stream=False, timeout=None):
+    """
+    Requests a URL conditionally, such that nothing needs to be parsed if the content has not changed since it was last processed. The ETag and Last-Modified validators of the last processed response are sent to the server, and the body of a full response is hashed in case the server does not support conditional requests. If RESPONSE_CACHE_DIRECTORY is set, the body is read from the shared cache instead, which is only refreshed from the server once it is older than RESPONSE_CACHE_TTL_SECONDS.
+
+    Parameters
+    ----------
+    url: String
+        The URL to request.
+    stream: Bool
+        If True, the body is read chunk by chunk into a temporary file while it is hashed, so that it can be parsed incrementally without being held in memory in full, and is only parsed if it has changed.
+    timeout: Float or None
+        The longest, in seconds, that the request and any retries of it may take. If None, retries are only limited by MAX_ATTEMPTS and the retry budget. Each attempt times out after CONNECT_TIMEOUT_SECONDS to connect, and READ_TIMEOUT_SECONDS of waiting for the server to send more.
+
+    Returns
+    -------
+    response: requests.Response, SpooledResponse, cache.CachedResponse or None
+        The response if the content is new, or None if the server replied 304 Not Modified or the body is identical to the last processed response.
+
+    """
+
+    if RESPONSE_CACHE_DIRECTORY != None:
+        return get_if_changed_through_cache(url, timeout)
+
+    last_response = LAST_RESPONSES.get(url, {})
+    response = request(url, last_response.get("etag"), last_response.get("last_modified"), stream=stream, timeout=timeout)
+    if response is None:
+        return None
+
+    # Many servers ignore the validators, so compare the body itself as well
+    if stream:
+        response = spool(response)
+    else:
+        response.digest = sha1(response.content).hexdigest()
+        response.size = len(response.content)
+    count_fetched_bytes(url, response.size)
+    if not has_changed(url, response.digest):
+        response.close()
+        return None
+
+    return response
+
+
+class SpooledResponse:
+    """Stands in for a streamed response once its body has been read into a temporary file, which is kept in memory until it grows past SPOOL_MAX_BYTES."""
+
+    def __init__(self, response, body, digest, size):
+        self.body = body
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.digest = digest
+        self.size = size
+
+    @property
+    def content(self):
+        _ = self.body.seek(0)
+        return self.body.read()
+
+    def iter_content(self, chunk_size=CHUNK_SIZE):
+        _ = self.body.seek(0)
+        yield from iter(partial(self.body.read, chunk_size), b"")
+
+    def json(self):
+        return json.loads(self.content)
+
+    def close(self):
+        self.body.close()
+
+
+def spool(response):
+    """Read a streamed response into a temporary file chunk by chunk, hashing it on the way, so that it can be checked for changes before it is parsed"""
+
+    body, digest, size = SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES), sha1(), 0
+    try:
+        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+            digest.update(chunk)
+            size += len(chunk)
+            _ = body.write(chunk)
+    except Exception:
+        body.close()
+        raise
+    finally:
+        response.close()
+    return SpooledResponse(response, body, digest.hexdigest(), size)
+
+
+def get_if_changed_through_cache(url, timeout=None):
+    """Read a URL from the shared response cache, which already knows the digest and size of the body. The body is memory mapped, so it is never held in memory in full even when it is streamed."""
+    # The cache is only imported when it is used, as the file locks it needs are not available on Windows
+    from cache import get_cached
+
+    downloaded = []
+
+    def download(metadata):
+        # Revalidate the cached body rather than this process's last response, as it is the cached body that would be reused
+        headers = metadata["headers"] if metadata != None else {}
+        response = request(url, headers.get("ETag"), headers.get("Last-Modified"), stream=True, timeout=timeout)
+        downloaded.append(response != None)
+        return response
+
+    response = get_cached(RESPONSE_CACHE_DIRECTORY, url, RESPONSE_CACHE_TTL_SECONDS, download)
+    # Only the process that downloaded the body counts it, rather than every process that reads it from the cache
+    if any(downloaded):
+        count_fetched_bytes(url, response.size)
+    if not has_changed(url, response.digest):
+        response.close()
+        return None
+    return response
+
+
+def request(url, etag=None, last_modified=None, stream=False, timeout=None):
+    """
+    Requests a URL through the shared session, sending the ETag and Last-Modified validators of an earlier response so that the server can skip sending the body. Failures that are likely to be transient are retried with a jittered exponential backoff, for as long as the URL's retry budget and the timeout allow.
+
+    Parameters
+    ----------
+    url: String
+        The URL to request.
+    etag: String or None
+        The ETag of an earlier response.
+    last_modified: String or None
+        The Last-Modified time of an earlier response.
+    stream: Bool
+        If True, the body is left unread.
+    timeout: Float or None
+        The longest, in seconds, that every attempt together may take. If None, there is no limit beyond the attempts and the retry budget.
+
+    Returns
+    -------
+    response: requests.Response or None
+        The response, or None if the server replied 304 Not Modified.
+
+    """
+
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+
+    # A hung read only uses up one attempt, leaving time before the deadline to retry it
+    deadline = monotonic() + timeout if timeout != None else None
+    earn_retry(url)
+
+    for attempt in range(MAX_ATTEMPTS):
+        read_timeout = READ_TIMEOUT_SECONDS if deadline is None else max(min(READ_TIMEOUT_SECONDS, deadline - monotonic()), 0.1)
+        try:
+            response = get_session().get(url, headers=headers, stream=stream, timeout=(CONNECT_TIMEOUT_SECONDS, read_timeout))
+        except (ConnectionError, Timeout):
+            if not wait_to_retry(url, attempt, deadline):
+                raise
+            continue
+
+        if response.status_code not in RETRYABLE_STATUS_CODES or not wait_to_retry(url, attempt, deadline, response.headers.get("Retry-After")):
+            break
+        response.close()
+
+    if response.status_code == 304:
+        response.close()
+        return None
+    response.raise_for_status()
+    return response
+
+
+def get_session():
+    """Create the shared session the first time it is needed, with a pool of connections that is large enough for every source to be polled at once"""
+
+    global SESSION
+    with SESSION_LOCK:
+        if SESSION is None:
+            SESSION = Session()
+            adapter = HTTPAdapter(pool_connections=CONNECTION_POOL_SIZE, pool_maxsize=CONNECTION_POOL_SIZE)
+            SESSION.mount("https://", adapter)
+            SESSION.mount("http://", adapter)
+            SESSION.headers["Accept-Encoding"] = "gzip, deflate"
+        return SESSION
+
+
+def wait_to_retry(url, attempt, deadline, retry_after=None):
+    """Wait before retrying a failed request, returning False instead if it should not be retried as the attempts, the time before the deadline or the URL's retry budget have run out"""
+
+    delay = RETRY_BASE_SECONDS * 2 ** attempt + uniform(0, RETRY_BASE_SECONDS)
+    # Wait for as long as the server asks, if it says how long in seconds
+    if retry_after != None and retry_after.isdigit():
+        delay = float(retry_after)
+    if attempt == MAX_ATTEMPTS - 1 or (deadline != None and monotonic() + delay > deadline) or not spend_retry(url):
+        return False
+
+    increment("covy_fetch_retries_total", host=urlsplit(url).netloc)
+    sleep(delay)
+    return True
+
+
+def earn_retry(url):
+    """Add to the retry budget of a URL for a request made to it, up to RETRY_BUDGET_MAX"""
+    with RETRY_BUDGETS_LOCK:
+        RETRY_BUDGETS[url] = min(RETRY_BUDGETS.get(url, RETRY_BUDGET_MAX) + RETRY_BUDGET_RATIO, RETRY_BUDGET_MAX)
+
+
+def spend_retry(url):
+    """Take one retry from the budget of a URL, returning False if there is not a whole retry left to spend"""
+    with RETRY_BUDGETS_LOCK:
+        if RETRY_BUDGETS.get(url, RETRY_BUDGET_MAX) < 1:
+            return False
+        RETRY_BUDGETS[url] = RETRY_BUDGETS.get(url, RETRY_BUDGET_MAX) - 1
+        return True
+
+
+def count_fetched_bytes(url, size):
+    """Add the size of a body this process downloaded to the bytes fetched from the URL's host, whether or not the body turns out to have changed"""
+    increment("covy_fetched_bytes_total", size, host=urlsplit(url).netloc)
+
+
+def has_changed(url, digest):
+    """
+    Checks whether the hash of a response body differs from the last processed response for the URL.
+
+    Parameters
+    ----------
+    url: String
+        The URL that was requested.
+    digest: String
+        The hexadecimal SHA-1 digest of the response body.
+
+    Returns
+    -------
+    changed: Bool
+        True if the body is different to the last processed response, or if no response has been processed yet.
+
+    """
+
+    return digest != LAST_RESPONSES.get(url, {}).get("digest")
+
+
+def mark_as_processed(url, response):
+    """
+    Records that a response has been fully processed, so that following requests for the URL are skipped until its content changes.
+
+    Parameters
+    ----------
+    url: String
+        The URL that was requested.
+    response: requests.Response
+        The response returned by get_if_changed.
+
+    Returns
+    -------
+    None : No parameters are outputted
+
+    """
+
+    LAST_RESPONSES[url] = {"etag": response.headers.get("ETag"),
+                           "last_modified": response.headers.get("Last-Modified"),
+                           "digest": response.digest}
@@ -0,0 +1,178 @@
+import json, threading, time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# The upper bounds, in seconds, of the buckets that every latency histogram counts into
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+HISTOGRAMS = {}
+COUNTERS = {}
+GAUGES = {}
+METRICS_LOCK = threading.Lock()
+
+
+def observe(name, value, **labels):
+    """
+    Records a value, such as a latency in seconds, in a histogram.
+
+    Parameters
+    ----------
+    name: String
+        The name of the histogram, e.g. 'covy_stage_seconds'.
+    value: Float
+        The value to record.
+    labels: Strings
+        The labels that identify which series of the histogram to record in, e.g. stage='fetch' and source='moh'.
+
+    Returns
+    -------
+    None : No parameters are outputted
+
+    """
+
+    key = (name, tuple(sorted(labels.items())))
+    with METRICS_LOCK:
+        histogram = HISTOGRAMS.setdefault(key, {"buckets": [0] * len(BUCKETS), "sum": 0.0, "count": 0})
+        for index, bound in enumerate(BUCKETS):
+            if value <= bound:
+                histogram["buckets"][index] += 1
+        histogram["sum"] += value
+        histogram["count"] += 1
+
+
+def increment(name, amount=1, **labels):
+    """Adds to a counter, such as the number of bytes fetched, where the labels identify which series of the counter to add to."""
+
+    key = (name, tuple(sorted(labels.items())))
+    with METRICS_LOCK:
+        COUNTERS[key] = COUNTERS.get(key, 0) + amount
+
+
+def set_gauge(name, value, **labels):
+    """Sets a gauge to its latest value, such as the number of rows last scraped, where the labels identify which series of the gauge to set."""
+
+    key = (name, tuple(sorted(labels.items())))
+    with METRICS_LOCK:
+        GAUGES[key] = value
+
+
+@contextmanager
+def timed(stage, source):
+    """
+    Times the code within the with block, recording it in the 'covy_stage_seconds' histogram for the stage and source.
+
+    Parameters
+    ----------
+    stage: String
+        The name of the stage, e.g. 'fetch', 'parse', 'normalise', 'diff', 'render' or 'notify'.
+    source: String
+        The name of the source, e.g. 'uc' or 'moh'.
+
+    """
+
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe("covy_stage_seconds", time.perf_counter() - started_at, stage=stage, source=source)
+
+
+def format_labels(labels, extra=()):
+    """Formats labels in the Prometheus text format, e.g. {stage="fetch",source="moh"}."""
+    labels = list(labels) + list(extra)
+    if len(labels) == 0:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"')) for key, value in labels) + "}"
+
+
+def render_prometheus():
+    """
+    Renders every metric in the Prometheus text exposition format.
+
+    Returns
+    -------
+    text: String
+        The metrics, with each histogram expanded into its cumulative buckets, sum and count.
+
+    """
+
+    lines = []
+    with METRICS_LOCK:
+        for metrics, kind in ((COUNTERS, "counter"), (GAUGES, "gauge")):
+            for name in sorted({name for name, _ in metrics}):
+                lines.append(f"# TYPE {name} {kind}")
+                lines.extend(f"{name}{format_labels(labels)} {value}" for (series_name, labels), value in sorted(metrics.items()) if series_name == name)
+
+        for name in sorted({name for name, _ in HISTOGRAMS}):
+            lines.append(f"# TYPE {name} histogram")
+            for (series_name, labels), histogram in sorted(HISTOGRAMS.items()):
+                if series_name != name:
+                    continue
+                # The buckets are already cumulative, as each value is counted into every bucket it fits within
+                for bound, count in zip(BUCKETS, histogram["buckets"]):
+                    lines.append(f"{name}_bucket{format_labels(labels, [('le', bound)])} {count}")
+                lines.append(f"{name}_bucket{format_labels(labels, [('le', '+Inf')])} {histogram['count']}")
+                lines.append(f"{name}_sum{format_labels(labels)} {histogram['sum']}")
+                lines.append(f"{name}_count{format_labels(labels)} {histogram['count']}")
+
+    return "\n".join(lines) + "\n"
+
+
+def dump_json():
+    """
+    Dumps every metric as JSON, with the labels of each series as a dictionary.
+
+    Returns
+    -------
+    text: String
+        A JSON object with the 'counters', 'gauges' and 'histograms', where each is a list of series.
+
+    """
+
+    with METRICS_LOCK:
+        return json.dumps({"counters": [{"name": name, "labels": dict(labels), "value": value} for (name, labels), value in sorted(COUNTERS.items())],
+                           "gauges": [{"name": name, "labels": dict(labels), "value": value} for (name, labels), value in sorted(GAUGES.items())],
+                           "histograms": [{"name": name, "labels": dict(labels), "buckets": dict(zip(map(str, BUCKETS), histogram["buckets"])), "sum": histogram["sum"], "count": histogram["count"]}
+                                          for (name, labels), histogram in sorted(HISTOGRAMS.items())]}, indent=2)
+
+
+def serve_metrics(port, host="127.0.0.1"):
+    """
+    Serves the metrics over HTTP in the background, in the Prometheus text format at /metrics and as JSON at /metrics.json.
+
+    Parameters
+    ----------
+    port: Integer
+        The port to listen on.
+    host: String
+        The address to listen on, which is only the local machine by default.
+
+    Returns
+    -------
+    server: http.server.ThreadingHTTPServer
+        The running server, which can be stopped with server.shutdown().
+
+    """
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/metrics":
+                body, content_type = render_prometheus(), "text/plain; version=0.0.4; charset=utf-8"
+            elif self.path == "/metrics.json":
+                body, content_type = dump_json(), "application/json"
+            else:
+                self.send_error(404)
+                return
+            body = body.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="covy-metrics", daemon=True).start()
+    return server
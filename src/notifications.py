@@ -0,0 +1,185 @@
+import queue, random, threading, time, warnings
+from metrics import observe, increment
+
+# Notifications for the same channel that arrive within this window are sent together
+COALESCE_SECONDS = 2
+MAX_ATTEMPTS = 5
+RETRY_BASE_SECONDS = 1
+
+NOTIFICATIONS = queue.Queue()
+NOTIFICATION_STATS = {"queued": 0, "sent": 0, "coalesced": 0, "retried": 0, "failed": 0}
+NOTIFICATION_STATS_LOCK = threading.Lock()
+WORKER = None
+WORKER_LOCK = threading.Lock()
+# If set, notifications are written to the end of this file instead of being posted to Slack, e.g. when replaying archived snapshots
+NOTIFICATION_FILEPATH = None
+NOTIFICATION_FILE_LOCK = threading.Lock()
+
+
+def queue_message(where_to_post, message_type, identifier=None, message=None, greet=True, sections=None):
+    """
+    Queues a message to be posted to a Slack Channel or User in the background, returning straight away. See slack.post_message for a description of the parameters.
+
+    Returns
+    -------
+    None : No parameters are outputted
+
+    """
+
+    enqueue({"kind": "message", "where_to_post": where_to_post, "message_type": message_type, "identifier": identifier, "message": message, "greet": greet, "sections": list(sections or [])})
+
+
+def enqueue(notification):
+    """Adds a notification to the queue, starting up the background worker the first time."""
+
+    if NOTIFICATION_FILEPATH != None:
+        write_notification(notification)
+        return
+
+    global WORKER
+    with WORKER_LOCK:
+        if WORKER is None or not WORKER.is_alive():
+            WORKER = threading.Thread(target=deliver_notifications, name="covy-notifications", daemon=True)
+            WORKER.start()
+
+    count("queued")
+    NOTIFICATIONS.put(notification)
+
+
+def write_notification(notification):
+    """Writes a notification to the end of the NOTIFICATION_FILEPATH as markdown, with each of its sections as a paragraph."""
+
+    text = f"#### {notification['message_type']} to {notification['where_to_post']} | {notification['identifier']}\n\n{notification['message']}\n\n"
+    text += "".join(f"{section['text']['text']}\n\n" for section in notification["sections"])
+
+    with NOTIFICATION_FILE_LOCK:
+        with open(NOTIFICATION_FILEPATH, "a", encoding="utf-8") as file:
+            _ = file.write(text)
+
+
+def get_notification_stats():
+    """
+    Retrieves how many notifications have been queued, sent, coalesced into another notification, retried and given up on.
+
+    Returns
+    -------
+    stats: Dictionary
+        A copy of the counters, along with the number of notifications still 'pending' in the queue.
+
+    """
+
+    with NOTIFICATION_STATS_LOCK:
+        return dict(NOTIFICATION_STATS, pending=NOTIFICATIONS.qsize())
+
+
+def flush():
+    """Blocks until every queued notification has been sent or given up on."""
+    NOTIFICATIONS.join()
+
+
+def count(name, amount=1):
+    """Adds to one of the notification counters."""
+    with NOTIFICATION_STATS_LOCK:
+        NOTIFICATION_STATS[name] += amount
+
+
+def deliver_notifications():
+    """Runs forever in the background worker, collecting notifications that arrive close together and sending them."""
+
+    while True:
+        batch = [NOTIFICATIONS.get()]
+
+        # Wait a moment for any other notifications from the same cycle before sending anything
+        deadline = time.monotonic() + COALESCE_SECONDS
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(NOTIFICATIONS.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        for notification in coalesce(batch):
+            send(notification)
+
+        for _ in batch:
+            NOTIFICATIONS.task_done()
+
+
+def coalesce(batch):
+    """Merges messages with the same channel, type and identifier into one message. Messages are only merged while their text and sections still fit in one Slack message, otherwise a new one is started. The notifications keep the order in which they first arrived."""
+    from slack import MAX_MESSAGE_TEXT_LENGTH, MAX_SECTIONS_PER_MESSAGE
+
+    merged, notifications = {}, []
+    for notification in batch:
+        key = (notification["where_to_post"], notification["message_type"], notification["identifier"])
+
+        # The sections of a later message follow its own message, so that each message stays above the sections it introduces
+        if len(notification["sections"]) > 0:
+            sections = [{"type": "section", "text": {"type": "mrkdwn", "text": notification["message"]}}] + notification["sections"]
+        else:
+            sections = []
+
+        # A message without sections is merged into the text of the first, which must still fit in its section
+        message = None
+        if key in merged and len(sections) == 0:
+            message = "\n\n".join(message for message in [merged[key]["message"], notification["message"]] if message)
+
+        if key not in merged or len(merged[key].get("sections", [])) + len(sections) > MAX_SECTIONS_PER_MESSAGE or len(message or "") > MAX_MESSAGE_TEXT_LENGTH:
+            merged[key] = dict(notification)
+            notifications.append(merged[key])
+            continue
+
+        count("coalesced")
+        if len(sections) > 0:
+            merged[key]["sections"] = merged[key]["sections"] + sections
+        else:
+            merged[key]["message"] = message
+
+    return notifications
+
+
+def send(notification):
+    """Sends a notification to Slack, waiting for as long as Slack asks when rate limited and backing off after a server or connection error. Any other error, such as a channel that does not exist, would only fail again, so it is given up on straight away."""
+
+    # The Slack client is only loaded once there is something to send, as most polls never notify
+    from slack import post_message
+    from slack_sdk.errors import SlackApiError
+
+    for attempt in range(MAX_ATTEMPTS):
+        started_at = time.perf_counter()
+        try:
+            post_message(notification["where_to_post"], notification["message_type"], notification["identifier"], notification["message"], greet=notification["greet"], raise_errors=True, sections=notification["sections"])
+            observe("covy_slack_seconds", time.perf_counter() - started_at, kind=notification["kind"])
+            increment("covy_slack_calls_total", kind=notification["kind"], outcome="sent")
+            count("sent")
+            return
+
+        except Exception as error:
+            observe("covy_slack_seconds", time.perf_counter() - started_at, kind=notification["kind"])
+            increment("covy_slack_calls_total", kind=notification["kind"], outcome="error")
+            if not is_retryable(error):
+                count("failed")
+                warnings.warn(f"The {notification['kind']} could not be posted to slack. Error: {error}", UserWarning)
+                return
+            if attempt == MAX_ATTEMPTS - 1:
+                count("failed")
+                warnings.warn(f"The {notification['kind']} could not be posted to slack after {MAX_ATTEMPTS} attempts. Error: {error}", UserWarning)
+                return
+
+            count("retried")
+            delay = RETRY_BASE_SECONDS * 2 ** attempt + random.uniform(0, RETRY_BASE_SECONDS)
+            if isinstance(error, SlackApiError) and error.response.status_code == 429:
+                delay = float(error.response.headers.get("Retry-After", error.response.headers.get("retry-after", delay)))
+            time.sleep(delay)
+
+
+def is_retryable(error):
+    """Check whether an error from posting to Slack could go away by itself, being a rate limit, an error on Slack's end or a failed connection."""
+    from slack_sdk.errors import SlackApiError
+
+    if isinstance(error, SlackApiError):
+        return error.response.status_code == 429 or error.response.status_code >= 500
+    # Connection errors and timeouts are all raised by slack_sdk as OSErrors, such as urllib.error.URLError
+    return isinstance(error, OSError)
@@ -0,0 +1,132 @@
+import numpy as np
+from bisect import bisect_left, bisect_right
+from math import asin, cos, degrees, pi, radians, sin
+
+EARTH_RADIUS_KM = 6371.0
+# The great-circle distance of one degree of latitude, which no location can be closer than to a point a degree north or south of it
+KM_PER_DEGREE_OF_LATITUDE = EARTH_RADIUS_KM * pi / 180
+
+
+def build_index(latitudes, longitudes, radii_km):
+    """
+    Builds a spatial index over points of interest, such that many locations can be matched against many points without comparing every pair. The points are sorted by latitude, so only the points within a band of latitudes around each location need their distance measured.
+
+    Parameters
+    ----------
+    latitudes: List of Floats
+        The latitude of each point of interest, in degrees.
+    longitudes: List of Floats
+        The longitude of each point of interest, in degrees.
+    radii_km: List of Floats
+        The distance from each point of interest, in kilometres, that a location must be within to be matched.
+
+    Returns
+    -------
+    index: Dictionary
+        The points sorted by latitude, along with their original order and a bounding box around each point's own radius.
+
+    """
+
+    latitudes = np.asarray(latitudes, dtype=float)
+    longitudes = np.asarray(longitudes, dtype=float)
+    radii_km = np.asarray(radii_km, dtype=float)
+    order = np.argsort(latitudes, kind="stable")
+
+    # The widest radius sets how far either side of a location the band of candidate points must reach
+    band = radii_km.max() / KM_PER_DEGREE_OF_LATITUDE if len(radii_km) > 0 else 0.0
+
+    # Every point gets its own box, as one box around all of them would cover most of the country once the points are far apart
+    boxes = [bounding_box(latitude, longitude, radius_km) for latitude, longitude, radius_km in zip(latitudes[order].tolist(), longitudes[order].tolist(), radii_km[order].tolist())]
+
+    return {"latitudes": latitudes[order], "longitudes": longitudes[order], "radii_km": radii_km[order], "order": order, "band": band,
+            "sorted_latitudes": latitudes[order].tolist(), "boxes": boxes}
+
+
+def bounding_box(latitude, longitude, radius_km):
+    """Finds the smallest box of latitudes and longitudes that holds every location within radius_km of a point, returned as (minimum_latitude, maximum_latitude, minimum_longitude, maximum_longitude)."""
+
+    angular_radius = radius_km / EARTH_RADIUS_KM
+    latitude_band = degrees(angular_radius)
+    # The widest longitude is reached where a great circle from the point touches the edge of the radius, and near a pole every longitude is within reach
+    if sin(angular_radius) < cos(radians(latitude)):
+        longitude_band = degrees(asin(sin(angular_radius) / cos(radians(latitude))))
+    else:
+        longitude_band = 180.0
+    return (latitude - latitude_band, latitude + latitude_band, longitude - longitude_band, longitude + longitude_band)
+
+
+def might_be_near(index, latitude, longitude):
+    """
+    Cheaply checks whether a location is inside the bounding box of any point of interest, such that locations far from every point can be dropped before any distances are measured. Only the points within the band of latitudes around the location are checked, which are found with a binary search.
+
+    Parameters
+    ----------
+    index: Dictionary
+        The index returned by build_index.
+    latitude: Float
+        The latitude of the location, in degrees.
+    longitude: Float
+        The longitude of the location, in degrees.
+
+    Returns
+    -------
+    near: Bool
+        True if the location is inside the bounding box of a point, and so may be within its radius.
+
+    """
+
+    start = bisect_left(index["sorted_latitudes"], latitude - index["band"])
+    end = bisect_right(index["sorted_latitudes"], latitude + index["band"])
+    return any(minimum_latitude <= latitude <= maximum_latitude and minimum_longitude <= longitude <= maximum_longitude
+               for minimum_latitude, maximum_latitude, minimum_longitude, maximum_longitude in index["boxes"][start:end])
+
+
+def find_nearby(index, latitudes, longitudes):
+    """
+    Matches locations against the points of interest in the index. The candidate points for every location are found with a binary search on latitude, and all of the candidate distances are then measured at once with the haversine formula.
+
+    Parameters
+    ----------
+    index: Dictionary
+        The index returned by build_index.
+    latitudes: List of Floats
+        The latitude of each location, in degrees.
+    longitudes: List of Floats
+        The longitude of each location, in degrees.
+
+    Returns
+    -------
+    location_indexes: numpy.ndarray
+        The position of the location in each match.
+    point_indexes: numpy.ndarray
+        The position of the point of interest in each match, in the order the points were given to build_index.
+    distances_km: numpy.ndarray
+        The distance between the location and the point of interest in each match, in kilometres.
+
+    """
+
+    latitudes = np.asarray(latitudes, dtype=float)
+    longitudes = np.asarray(longitudes, dtype=float)
+
+    # Find the range of sorted points whose latitude is close enough to each location
+    starts = np.searchsorted(index["latitudes"], latitudes - index["band"], side="left")
+    ends = np.searchsorted(index["latitudes"], latitudes + index["band"], side="right")
+    counts = ends - starts
+
+    # Expand the ranges into one (location, point) pair per candidate
+    location_indexes = np.repeat(np.arange(len(latitudes)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    sorted_point_indexes = np.repeat(starts, counts) + offsets
+
+    distances_km = haversine_km(latitudes[location_indexes], longitudes[location_indexes], index["latitudes"][sorted_point_indexes], index["longitudes"][sorted_point_indexes])
+    matched = distances_km <= index["radii_km"][sorted_point_indexes]
+
+    return location_indexes[matched], index["order"][sorted_point_indexes[matched]], distances_km[matched]
+
+
+def haversine_km(latitudes_a, longitudes_a, latitudes_b, longitudes_b):
+    """Measures the great-circle distance in kilometres between each pair of coordinates, given in degrees."""
+
+    latitudes_a, longitudes_a, latitudes_b, longitudes_b = map(np.radians, (latitudes_a, longitudes_a, latitudes_b, longitudes_b))
+    a = np.sin((latitudes_b - latitudes_a) / 2) ** 2 + np.cos(latitudes_a) * np.cos(latitudes_b) * np.sin((longitudes_b - longitudes_a) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
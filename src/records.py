@@ -0,0 +1,9 @@
+from collections import namedtuple
+
+# Locations are kept as named tuples rather than dictionaries or DataFrames, as they are compact and fast to create, hash and compare
+
+# A location of interest from the Ministry of Health's API. The city and coordinates are only used to route and match the location, and are not kept in the store.
+MohLocation = namedtuple("MohLocation", ["eventName", "address", "startDateTime", "endDateTime", "exposureType", "city", "latitude", "longitude"], defaults=[None, None, None])
+
+# A location of interest from the University of Canterbury's website
+UcLocation = namedtuple("UcLocation", ["Location", "Date", "Time", "Categorisation", "Added"])
@@ -0,0 +1,169 @@
+"""
+Replays archived snapshots of the MOH API and the UC page, producing the full timeline of changes between them rather than polling the live sources.
+
+Snapshots are named after their source and the time they were taken, such that the times sort in order, e.g. moh-2021-10-20T10-10-00.json or uc_20211020T101000.html.
+
+Usage:
+    python replay.py SNAPSHOT_DIRECTORY --output timeline.jsonl [--notifications notifications.md] [--workers 8]
+"""
+
+import argparse, json, os, re
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from math import ceil
+from changes import find_changes
+import covy, notifications
+
+SNAPSHOT_PATTERN = re.compile(r"^(?P<source>[a-z]+)[-_](?P<taken_at>.+?)(\.[a-z]+)?$")
+CHUNK_SIZE = 64 * 1024
+
+
+class SnapshotResponse:
+    """Stands in for the response of a source, reading the body from an archived snapshot instead."""
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.headers = {}
+        self.digest = None
+        self.size = None
+
+    @property
+    def content(self):
+        with open(self.filepath, "rb") as file:
+            return file.read()
+
+    def iter_content(self, chunk_size=CHUNK_SIZE):
+        with open(self.filepath, "rb") as file:
+            yield from iter(partial(file.read, chunk_size), b"")
+
+    def json(self):
+        return json.loads(self.content)
+
+
+def find_snapshots(directory):
+    """
+    Lists the snapshots in a directory for every registered source, in the order they were taken.
+
+    Parameters
+    ----------
+    directory: String
+        The path to the directory of snapshots.
+
+    Returns
+    -------
+    snapshots: Dictionary
+        A dictionary mapping each source name to a list of (taken_at, filepath) tuples, sorted by taken_at.
+
+    """
+
+    snapshots = {}
+    for filename in os.listdir(directory):
+        match = SNAPSHOT_PATTERN.match(filename)
+        if match and match.group("source") in covy.SOURCES:
+            snapshots.setdefault(match.group("source"), []).append((match.group("taken_at"), os.path.join(directory, filename)))
+
+    return {source: sorted(source_snapshots) for source, source_snapshots in snapshots.items()}
+
+
+def parse_snapshot(source, filepath):
+    """Parse a snapshot with the source's own parser, and split its rows into the source's groups."""
+    current_rows = source.parse(SnapshotResponse(filepath))
+    return source.group(current_rows) if source.group != None else {None: current_rows}
+
+
+def replay_chunk(source_name, snapshots):
+    """
+    Diffs each consecutive pair of snapshots in a chunk, parsing every snapshot only once. Runs in a worker process.
+
+    Parameters
+    ----------
+    source_name: String
+        The name of the source the snapshots were taken of.
+    snapshots: List of Tuples
+        The (taken_at, filepath) of each snapshot in the chunk, where the first snapshot is only used as the starting point. A first snapshot of (None, None) starts from nothing, so every location in the second snapshot is new.
+
+    Returns
+    -------
+    changes: List of Tuples
+        The (previous_taken_at, taken_at, group, group_changes) for each pair of snapshots and group that had changes, where group_changes are the Changes returned by find_changes.
+
+    """
+
+    source = covy.SOURCES[source_name]
+    changes = []
+    previous_taken_at, previous_filepath = snapshots[0]
+    previous_groups = parse_snapshot(source, previous_filepath) if previous_filepath != None else {}
+
+    for taken_at, filepath in snapshots[1:]:
+        groups = parse_snapshot(source, filepath)
+        for group in previous_groups.keys() | groups.keys():
+            group_changes = find_changes(previous_groups.get(group, []), groups.get(group, []), source.key_columns, source.columns)
+            if len(group_changes) > 0:
+                changes.append((previous_taken_at, taken_at, group, group_changes))
+        previous_taken_at, previous_groups = taken_at, groups
+
+    return changes
+
+
+def replay(directory, output_filepath, notifications_filepath=None, workers=None):
+    """
+    Replays every snapshot in a directory across a pool of processes, writing the changes between each consecutive pair of snapshots to a JSON lines file.
+
+    Parameters
+    ----------
+    directory: String
+        The path to the directory of snapshots.
+    output_filepath: String
+        The path to write the timeline to, with one JSON object per changed row.
+    notifications_filepath: String or None
+        If given, the notifications that would have been sent to Slack for each change are written to this file instead.
+    workers: Integer or None
+        The number of processes to use. If None, one per core is used.
+
+    Returns
+    -------
+    None : No parameters are outputted
+
+    """
+
+    workers = workers or os.cpu_count()
+    if notifications_filepath != None:
+        notifications.NOTIFICATION_FILEPATH = notifications_filepath
+        open(notifications_filepath, "w").close()
+
+    # Split each source's snapshots into overlapping chunks, so that every pair is diffed exactly once and each worker has a few chunks to do
+    jobs = []
+    for source_name, snapshots in find_snapshots(directory).items():
+        # The first snapshot is diffed against nothing, so every location in it is new
+        snapshots = [(None, None)] + snapshots
+        chunk_size = max(2, ceil(len(snapshots) / (workers * 4)) + 1)
+        for start in range(0, len(snapshots) - 1, chunk_size - 1):
+            jobs.append((source_name, snapshots[start:start + chunk_size]))
+
+    with ProcessPoolExecutor(max_workers=workers) as pool, open(output_filepath, "w", encoding="utf-8") as output_file:
+        for (source_name, _), changes in zip(jobs, pool.map(replay_chunk, [job[0] for job in jobs], [job[1] for job in jobs])):
+            for previous_taken_at, taken_at, group, group_changes in changes:
+                for change in group_changes:
+                    row = {column: getattr(change.row, column) for column in covy.SOURCES[source_name].columns}
+                    row["Status"] = change.status
+                    _ = output_file.write(json.dumps({"source": source_name, "group": group, "from": previous_taken_at, "to": taken_at, **row}) + "\n")
+
+                if notifications_filepath != None:
+                    with open(notifications_filepath, "a", encoding="utf-8") as file:
+                        _ = file.write(f"## {source_name} at {taken_at}\n\n")
+                    covy.SOURCES[source_name].notify(group_changes, group)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("directory", help="The directory of snapshots to replay.")
+    parser.add_argument("--output", default="timeline.jsonl", help="The file to write the timeline of changes to.")
+    parser.add_argument("--notifications", default=None, help="If given, the file to write the notifications that would have been sent to.")
+    parser.add_argument("--workers", type=int, default=None, help="The number of processes to use, which is one per core by default.")
+    arguments = parser.parse_args()
+
+    replay(arguments.directory, arguments.output, arguments.notifications, arguments.workers)
+
+
+if __name__ == "__main__":
+    main()
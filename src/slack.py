@@ -1,4 +1,4 @@
-import os, random, slack_sdk, slack_sdk.errors, socket, textwrap, warnings, dotenv
+import os, random, slack_sdk, slack_sdk.errors, socket, textwrap, threading, time, warnings, dotenv
 
 GREETINGS = ["Kia ora!", "Howdy partner.", "G'day mate.", "What up g? :sunglasses:", "Ugh finally, this shit is done.", "Kachow! :racing_car:", "Kachigga! :racing_car:", "Sup dude.", "Woaaaaahhhh, would you look at that!", "Easy peasy.", "Rock on bro. :call_me_hand:", "Leshgoooooo!", "Let's get this bread!", "You're doing great dude. :kissing_heart:", "Another one bits the dust...", "Sup, having a good day?", "Yeeeeeeehaw cowboy! :face_with_cowboy_hat:"] 
 HAPPY_EMOJIS = [":tada:", ":cheering-bec:", ":smiley_mitch:", ":ecstatic_tom:", ":partying_face:", ":happy-patrick:", ":happy_tom:", ":dabtom:"]
@@ -7,7 +7,22 @@ SAD_EMOJIS = [":sad_will:", ":sad_willandluci:", ":cry:", ":disappointed_relieve
 _ = dotenv.load_dotenv()
 SLACK_TOKEN = os.getenv('SLACK_TOKEN')
 
-def post_message(where_to_post, message_type, identifier=None, message=None, greet=True, silent_usernames=None, emojis=False):
+# One client is shared by every post, and the workspace's users are cached so that each name lookup does not list every member again
+CLIENT = None
+USER_DIRECTORY_TTL_SECONDS = 60 * 60
+USER_DIRECTORY = {"loaded_at": None, "members": [], "by_id": {}, "by_name": {}}
+USER_DIRECTORY_LOCK = threading.Lock()
+CHANNEL_DIRECTORY = {}
+CHANNEL_DIRECTORY_LOCK = threading.Lock()
+
+# Slack rejects a message with more than 50 blocks, or a section with more than 3000 characters. Up to three header lines, two dividers and the message come before any extra sections.
+MAX_BLOCKS_PER_MESSAGE = 50
+MAX_SECTIONS_PER_MESSAGE = MAX_BLOCKS_PER_MESSAGE - 6
+MAX_SECTION_TEXT_LENGTH = 3000
+# The message shares its section with a greeting, so it must leave room for the longest one
+MAX_MESSAGE_TEXT_LENGTH = MAX_SECTION_TEXT_LENGTH - max(len(greeting) for greeting in GREETINGS) - 1
+
+def post_message(where_to_post, message_type, identifier=None, message=None, greet=True, silent_usernames=None, emojis=False, raise_errors=False, sections=None):
     """
     Posts a message to a Slack Channel or User.
     
@@ -27,6 +42,10 @@ def post_message(where_to_post, message_type, identifier=None, message=None, gre
         If silent_usernames is specified, then the message is posted to the channel (irrelevant if public or private) but only the silent_users can see the message.
     emjois: Bool 
         If True, the message_type will be wrapped with 2 appropiate emojis on either side. Otherwise, no emjois will be printed.
+    raise_errors: Bool
+        If True, a SlackApiError is raised so that the caller can retry the post. Otherwise, it is turned into a warning.
+    sections: List of Dictionaries or None
+        Section blocks to post below the message, such as one list of those returned by pack_sections. There can be no more than MAX_SECTIONS_PER_MESSAGE of them.
 
     Returns
     -------
@@ -34,8 +53,8 @@ def post_message(where_to_post, message_type, identifier=None, message=None, gre
     
     """
 
-    # Start up the client to post to
-    client = slack_sdk.WebClient(token=SLACK_TOKEN)
+    # Grab the shared client to post to
+    client = get_client()
     
     # If it is not a channel, grab the user's ID instead to DM them
     if not where_to_post.startswith("#"):
@@ -43,7 +62,7 @@ def post_message(where_to_post, message_type, identifier=None, message=None, gre
 
     # Generate the content used in the message
     header, header_lines = generate_header(message_type, identifier, emojis) 
-    blocks = generate_blocks(message_type, message, header_lines, greet)
+    blocks = generate_blocks(message_type, message, header_lines, greet, sections)
 
     try:
         # Send a quiet message if requested
@@ -59,6 +78,8 @@ def post_message(where_to_post, message_type, identifier=None, message=None, gre
             _ = client.chat_postMessage(channel=where_to_post, blocks=blocks, text=header)
     
     except slack_sdk.errors.SlackApiError as error:
+        if raise_errors:
+            raise
         warnings.warn("The message could not be posted to slack. Error: {}".format(error.response["error"]), UserWarning)
 
 
@@ -109,7 +130,7 @@ def generate_header(message_type, identifier, emojis):
     return header, header_lines
 
 
-def generate_blocks(message_type, message, header_lines, greet):
+def generate_blocks(message_type, message, header_lines, greet, sections=None):
     """
     Generates the blocks, a JSON-based list of structured blocks presented as URL-encoded strings, to be used to display message to be posted to the Slack channel or User.
 
@@ -124,6 +145,8 @@ def generate_blocks(message_type, message, header_lines, greet):
         A string that will be used in the header to help identify which simulation the message is referring to. It is recommended that the length of the identifier is kept under 100 characters in order to display the header on one line.
     greet: Bool
         If True, post a cheerful greeting before the message.
+    sections: List of Dictionaries or None
+        If given, these section blocks are added below a divider after the message.
 
     Returns
     -------
@@ -175,11 +198,52 @@ def generate_blocks(message_type, message, header_lines, greet):
                     "text": {"type": "mrkdwn",
                             "text": message.strip("\r\n")}
                     }])
+
+    if sections:
+        blocks.append({"type": "divider"})
+        blocks.extend(sections)
     
     return blocks
 
 
-def post_files(where_to_post, filenames, message, greet=True):
+def pack_sections(lines):
+    """
+    Packs lines of mrkdwn text into as few section blocks as fit within MAX_SECTION_TEXT_LENGTH, and then splits those sections into as few messages as fit within MAX_SECTIONS_PER_MESSAGE. A line that is too long for a section by itself is cut short.
+
+    Example:
+    [[{"type": "section", "text": {"type": "mrkdwn", "text": "*New Location:* Library\n*Removed Location:* Gym"}}]]
+
+    Parameters
+    ----------
+    lines: List of Strings
+        The lines to post, such as one per changed location. Any text from outside of Covy should be escaped with escape_mrkdwn first.
+
+    Returns
+    -------
+    messages: List of Lists of Dictionaries
+        The section blocks of each message to post, in order, which can each be given to post_message as its sections.
+
+    """
+
+    texts = []
+    for line in lines:
+        if len(line) > MAX_SECTION_TEXT_LENGTH:
+            line = line[:MAX_SECTION_TEXT_LENGTH - 1] + "…"
+        if len(texts) > 0 and len(texts[-1]) + 1 + len(line) <= MAX_SECTION_TEXT_LENGTH:
+            texts[-1] += "\n" + line
+        else:
+            texts.append(line)
+
+    sections = [{"type": "section", "text": {"type": "mrkdwn", "text": text}} for text in texts]
+    return [sections[start:start + MAX_SECTIONS_PER_MESSAGE] for start in range(0, len(sections), MAX_SECTIONS_PER_MESSAGE)]
+
+
+def escape_mrkdwn(text):
+    """Escapes the characters that Slack uses for links and mentions in mrkdwn, so that text from a website is shown as it is."""
+    return str(text).replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def post_files(where_to_post, filenames, message, greet=True, raise_errors=False):
     """
     Posts files to a Slack Channel or User.
     
@@ -187,12 +251,14 @@ def post_files(where_to_post, filenames, message, greet=True):
     ----------
     where_to_post: String
         A string representing the channel or person's name to post/directly message to. Note: if you wish to post to a channel, a hashtag ("#") must be placed at the start of the string, otherwise it is assumed that the message
-    filenames : String or List of Strings
-        A string representing the filepath to the file to be posted, or a list of strings to post.
+    filenames : String, Tuple or List of Strings and Tuples
+        A string representing the filepath to the file to be posted, or a (filename, content) tuple to post content held in memory as a file without touching the disk. The content can be a string or bytes. A list of these can be given to post them all in a single upload.
     message: String
         A text message to display above the file in the Slack channel, primarily used to describe or introduce the file uploaded. 
     greet: Bool
         If True, post a cheerful greeting before the message.
+    raise_errors: Bool
+        If True, a SlackApiError is raised so that the caller can retry the post. Otherwise, it is turned into a warning.
 
     Returns
     -------
@@ -200,36 +266,138 @@ def post_files(where_to_post, filenames, message, greet=True):
     
     """
 
-    # Start up the client to post to
-    client = slack_sdk.WebClient(token=SLACK_TOKEN)
-    
-    # If it is not a channel, grab the user's ID instead to DM them
-    if not where_to_post.startswith("#"):
-        where_to_post = get_users_information_from_name(where_to_post, "id", client)
+    # Grab the shared client to post to
+    client = get_client()
 
     # Add a greeting if the user asked for one
     greeting = random.sample(GREETINGS, 1)[0] + " " if greet else ""
     
-    # In case only one file was passed in, then chuck the string into a list by itself
-    if type(filenames) == str:
+    # In case only one file was passed in, then chuck it into a list by itself
+    if type(filenames) in (str, tuple):
         filenames = [filenames]
 
+    # Files on disk are uploaded by path, while files in memory are uploaded by their content
+    file_uploads = []
+    for filename in filenames:
+        if type(filename) == tuple:
+            file_uploads.append({"filename": filename[0], "content": filename[1], "title": filename[0]})
+        else:
+            file_uploads.append({"file": filename})
+
     try:
-        inital_comment_sent = False
-        for filename in filenames:
-            if not inital_comment_sent:
-                # Send the files with the initial comment as it has not been sent yet
-                _ = client.files_upload(channels=where_to_post, initial_comment=greeting+message, file=filename)
-                inital_comment_sent = True
-            else:
-                # Otherwise send just the files
-                _ = client.files_upload(channels=where_to_post, file=filename)
-    
+        # Uploads need the ID of the channel (or of the direct message with a user) rather than its name
+        channel_id = get_channel_id(where_to_post, client)
+
+        # Send all of the files in one upload, with the initial comment above them
+        _ = client.files_upload_v2(channel=channel_id, initial_comment=greeting+message, file_uploads=file_uploads)
+
     except slack_sdk.errors.SlackApiError as error:
-        warnings.warn("The file {} could not be posted to slack. Error: {}".format(filename, error.response["error"]), UserWarning)
+        if raise_errors:
+            raise
+        filenames = [filename[0] if type(filename) == tuple else filename for filename in filenames]
+        warnings.warn("The files {} could not be posted to slack. Error: {}".format(filenames, error.response["error"]), UserWarning)
 
 
-def get_users_information_from_name(user_name, wanted_information, client):
+def get_channel_id(where_to_post, client):
+    """
+    Retrieves the ID of a channel, or of the direct message with a user, from its name. The IDs of the workspace's channels are cached and only listed again when a channel cannot be found.
+
+    Parameters
+    ----------
+    where_to_post: String
+        A string representing the channel or person's name. Note: channels must start with a hashtag ("#"), otherwise it is assumed that the name is of a person.
+    client: slack_sdk.WebClient
+        The client used to look up the channel or user.
+
+    Returns
+    -------
+    channel_id: String
+        The ID of the channel or of the direct message.
+
+    """
+
+    # If it is not a channel, grab the user's ID and open a direct message with them
+    if not where_to_post.startswith("#"):
+        user_id = get_users_information_from_name(where_to_post, "id", client)
+        return client.conversations_open(users=user_id)["channel"]["id"]
+
+    channel_name = where_to_post[1:]
+    with CHANNEL_DIRECTORY_LOCK:
+        if channel_name not in CHANNEL_DIRECTORY:
+            # Read every page of channels, as conversations_list only returns the first page by default
+            cursor = None
+            while True:
+                response = client.conversations_list(types="public_channel,private_channel", exclude_archived=True, limit=1000, cursor=cursor)
+                CHANNEL_DIRECTORY.update({channel["name"]: channel["id"] for channel in response["channels"]})
+                cursor = response.get("response_metadata", {}).get("next_cursor")
+                if not cursor:
+                    break
+
+        # Fall back to the name itself, in case it was the ID of the channel all along
+        return CHANNEL_DIRECTORY.get(channel_name, channel_name)
+
+
+def get_client():
+    """
+    Retrieves the Slack client shared by every post, starting it up the first time it is needed.
+
+    Returns
+    -------
+    client: slack_sdk.WebClient
+        The shared client, authenticated with the SLACK_TOKEN.
+
+    """
+
+    global CLIENT
+    if CLIENT is None:
+        CLIENT = slack_sdk.WebClient(token=SLACK_TOKEN)
+    return CLIENT
+
+
+def get_user_directory(client):
+    """
+    Retrieves the cached directory of active users in the workspace, reading every page of members again once the cache is older than USER_DIRECTORY_TTL_SECONDS. The members are indexed by their id and by the title case of their real, display and normalised names.
+
+    Parameters
+    ----------
+    client: slack_sdk.WebClient
+        The client used to list the members of the workspace.
+
+    Returns
+    -------
+    user_directory: Dictionary
+        A dictionary holding the list of 'members', the 'by_id' index of members and the 'by_name' index of lists of members.
+
+    """
+
+    with USER_DIRECTORY_LOCK:
+        if USER_DIRECTORY["loaded_at"] is not None and time.monotonic() - USER_DIRECTORY["loaded_at"] < USER_DIRECTORY_TTL_SECONDS:
+            return USER_DIRECTORY
+
+        # Read every page of members, as users_list only returns the first page by default
+        members = []
+        cursor = None
+        while True:
+            response = client.users_list(limit=200, cursor=cursor)
+            members.extend(member for member in response["members"] if not member["deleted"] and not member["is_bot"])
+            cursor = response.get("response_metadata", {}).get("next_cursor")
+            if not cursor:
+                break
+
+        by_id = {}
+        by_name = {}
+        for member in members:
+            by_id[member["id"]] = member
+            profile_details = member.get("profile", {})
+            names = {profile_details.get(field, "").title() for field in ["real_name", "display_name", "real_name_normalized", "display_name_normalized"]}
+            for name in names - {""}:
+                by_name.setdefault(name, []).append(member)
+
+        USER_DIRECTORY.update({"loaded_at": time.monotonic(), "members": members, "by_id": by_id, "by_name": by_name})
+        return USER_DIRECTORY
+
+
+def get_users_information_from_name(user_name, wanted_information, client=None):
     """
     Retrieves a specified *wanted_information* attribute of a user by the name of *user_name*. The *user_name* can be the full name of the individual or their display name. If no exact matches are found, then possible matches are considered by their full name, display name and by first name and surname.
     
@@ -239,6 +407,8 @@ def get_users_information_from_name(user_name, wanted_information, client):
         A string representing the name of the user to be contacted, e.g. 'Sam Archie' or 'tom'. 
     wanted_information: String
         A string representing the  
+    client: slack_sdk.WebClient or None
+        The client used to look up the workspace's users. If None, the shared client is used.
     greet: Bool
         If True, post a cheerful greeting before the message.
    
@@ -248,53 +418,40 @@ def get_users_information_from_name(user_name, wanted_information, client):
     
     """
 
-    # Change the user_name to title case so we can == compare it with the other fields
-    user_name = user_name.title()
-    
-    # Create lists for exact and possible matches
-    exact_matches = []
-    possible_matches = []
-
-    # Query the client for a list of members
-    members = client.users_list()["members"]
-
-    for member in members:
-        # If inactive user or is a bot then continue to the next
-        if member["deleted"] or member["is_bot"]:
-            continue
-        
-        # Check for exact results of id! E.g. the user passed in the actual id of the person, so why bother looking any further!
-        if member.get("id", "") == user_name:
-            return user_name
-        
-        # Check for exact mataches against the profile
-        profile_details = member.get("profile", {})
-        if profile_details.get("real_name", "").title() == user_name:
-            exact_matches.append(member)
-        elif profile_details.get("display_name", "").title() == user_name:
-            exact_matches.append(member)
-        elif profile_details.get("real_name_normalized", "").title() == user_name:
-            exact_matches.append(member)
-        elif profile_details.get("display_name_normalized", "").title() == user_name:
-            exact_matches.append(member)
-
-        # Check for possible matches
-        elif user_name in member.get("id", ""):
-            possible_matches.append(member)
-        elif user_name in profile_details.get("real_name", "").title():
-            possible_matches.append(member)
-        elif user_name in profile_details.get("display_name", "").title():
-            possible_matches.append(member)
-        elif user_name in profile_details.get("real_name_normalized", "").title():
-            possible_matches.append(member)
-        elif user_name in profile_details.get("display_name_normalized", "").title():
-            possible_matches.append(member)
-        elif user_name.split(" ")[0] in profile_details.get("first_name", "").title():
-            possible_matches.append(member)
-        elif user_name.split(" ")[-1] in profile_details.get("last_name", "").title():
-            possible_matches.append(member)
+    user_directory = get_user_directory(client if client != None else get_client())
+
+    # Check for exact results of id! E.g. the user passed in the actual id of the person, so why bother looking any further!
+    if user_name in user_directory["by_id"]:
+        exact_matches = [user_directory["by_id"][user_name]]
+        possible_matches = []
+
+    else:
+        # Change the user_name to title case so we can look it up against the other fields
+        user_name = user_name.title()
+
+        # Look up the exact matches against the profile
+        exact_matches = user_directory["by_name"].get(user_name, [])
+
+        # Only check for possible matches if there were no exact matches
+        possible_matches = []
+        if len(exact_matches) == 0:
+            for member in user_directory["members"]:
+                profile_details = member.get("profile", {})
+                if user_name in member.get("id", ""):
+                    possible_matches.append(member)
+                elif user_name in profile_details.get("real_name", "").title():
+                    possible_matches.append(member)
+                elif user_name in profile_details.get("display_name", "").title():
+                    possible_matches.append(member)
+                elif user_name in profile_details.get("real_name_normalized", "").title():
+                    possible_matches.append(member)
+                elif user_name in profile_details.get("display_name_normalized", "").title():
+                    possible_matches.append(member)
+                elif user_name.split(" ")[0] in profile_details.get("first_name", "").title():
+                    possible_matches.append(member)
+                elif user_name.split(" ")[-1] in profile_details.get("last_name", "").title():
+                    possible_matches.append(member)
 
-    
     if len(exact_matches) == 1:
         # Best case scenario!
         chosen_user_details = exact_matches[0]
@@ -0,0 +1,164 @@
+from datetime import datetime, timedelta, timezone
+from json import dumps, loads
+from sqlite3 import connect as sqlite_connect
+from changes import fingerprint, NEW_STATUS, MODIFIED_STATUS, REMOVED_STATUS
+
+# Every row ever seen is kept once, keyed by the fingerprint of its values, along with every period it was listed for. A row is still listed while the last_seen of its latest listing is NULL, and it can only have one such listing at a time.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS locations (
+    source TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (source, fingerprint)
+);
+CREATE TABLE IF NOT EXISTS listings (
+    source TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    first_seen TEXT NOT NULL,
+    last_seen TEXT
+);
+CREATE UNIQUE INDEX IF NOT EXISTS listings_still_listed ON listings (source, fingerprint) WHERE last_seen IS NULL;
+CREATE INDEX IF NOT EXISTS listings_by_last_seen ON listings (source, last_seen);
+CREATE INDEX IF NOT EXISTS listings_by_first_seen ON listings (source, first_seen);
+"""
+
+
+def connect(filepath):
+    """
+    Opens the snapshot store, creating the tables and indexes if they do not exist yet. The store is put in WAL mode so that history can be read while a scrape is writing.
+
+    Parameters
+    ----------
+    filepath: String
+        The path to the SQLite database file.
+
+    Returns
+    -------
+    connection: sqlite3.Connection
+        A connection to the store.
+
+    """
+
+    connection = sqlite_connect(filepath, timeout=30)
+    _ = connection.execute("PRAGMA journal_mode=WAL")
+    _ = connection.execute("PRAGMA synchronous=NORMAL")
+    _ = connection.executescript(SCHEMA)
+    return connection
+
+
+def load_current_rows(connection, source, record_type):
+    """
+    Retrieves the rows that were listed by a source when it was last scraped.
+
+    Parameters
+    ----------
+    connection: sqlite3.Connection
+        A connection to the store.
+    source: String
+        The name of the source, e.g. 'uc' or 'moh'.
+    record_type: Named Tuple Class
+        The type of the rows, such as records.MohLocation.
+
+    Returns
+    -------
+    rows: List of Named Tuples
+        The rows that are still listed.
+
+    """
+
+    cursor = connection.execute("""SELECT locations.data FROM listings JOIN locations USING (source, fingerprint)
+                                   WHERE listings.source = ? AND listings.last_seen IS NULL""", (source,))
+    return [record_type(**loads(data)) for (data,) in cursor]
+
+
+def save_changes(connection, source, changes, columns, seen_at=None):
+    """
+    Records the changes found by find_changes, such that only the changed rows are written. New rows start a new listing (keeping any earlier listings from before they were removed), and the listings of removed rows are given a last_seen time. A modified row is saved as a new row, and the listing of the row it replaced is given a last_seen time.
+
+    Parameters
+    ----------
+    connection: sqlite3.Connection
+        A connection to the store.
+    source: String
+        The name of the source, e.g. 'uc' or 'moh'.
+    changes: List of Changes
+        The changes returned by find_changes.
+    columns: List of Strings
+        The columns that were compared by find_changes, which are also the columns that are stored.
+    seen_at: String or None
+        An ISO 8601 time to record the changes at. If None, the current UTC time is used.
+
+    Returns
+    -------
+    None : No parameters are outputted
+
+    """
+
+    if seen_at is None:
+        seen_at = datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+    listed_rows = [change.row for change in changes if change.status in (NEW_STATUS, MODIFIED_STATUS)]
+    unlisted_rows = [change.row for change in changes if change.status == REMOVED_STATUS]
+    unlisted_rows += [change.previous for change in changes if change.status == MODIFIED_STATUS]
+
+    listed_fingerprints = [fingerprint(row, columns) for row in listed_rows]
+    with connection:
+        _ = connection.executemany("INSERT INTO locations (source, fingerprint, data) VALUES (?, ?, ?) ON CONFLICT (source, fingerprint) DO NOTHING",
+                                   [(source, row_fingerprint, dumps({column: getattr(row, column) for column in columns})) for row_fingerprint, row in zip(listed_fingerprints, listed_rows)])
+        _ = connection.executemany("INSERT OR IGNORE INTO listings (source, fingerprint, first_seen) VALUES (?, ?, ?)",
+                                   [(source, row_fingerprint, seen_at) for row_fingerprint in listed_fingerprints])
+        _ = connection.executemany("UPDATE listings SET last_seen = ? WHERE source = ? AND fingerprint = ? AND last_seen IS NULL",
+                                   [(seen_at, source, fingerprint(row, columns)) for row in unlisted_rows])
+
+
+def load_rows_listed_on(connection, source, date, record_type):
+    """
+    Retrieves the rows that were listed by a source at any time on a given UTC date.
+
+    Parameters
+    ----------
+    connection: sqlite3.Connection
+        A connection to the store.
+    source: String
+        The name of the source, e.g. 'uc' or 'moh'.
+    date: datetime.date
+        The date of interest.
+    record_type: Named Tuple Class
+        The type of the rows, such as records.MohLocation.
+
+    Returns
+    -------
+    rows: List of Named Tuples
+        The rows that were listed on that date.
+
+    """
+
+    start_of_day = datetime(date.year, date.month, date.day, tzinfo=timezone.utc)
+    end_of_day = start_of_day + timedelta(days=1)
+    cursor = connection.execute("""SELECT DISTINCT locations.data FROM listings JOIN locations USING (source, fingerprint)
+                                   WHERE listings.source = ? AND listings.first_seen < ? AND (listings.last_seen IS NULL OR listings.last_seen >= ?)""",
+                                (source, end_of_day.isoformat(timespec="seconds"), start_of_day.isoformat(timespec="seconds")))
+    return [record_type(**loads(data)) for (data,) in cursor]
+
+
+def count_new_rows_per_day(connection, source):
+    """
+    Counts how many rows were first listed by a source on each UTC date, where a row that was listed again after being removed is only counted on the date it was first ever listed.
+
+    Parameters
+    ----------
+    connection: sqlite3.Connection
+        A connection to the store.
+    source: String
+        The name of the source, e.g. 'uc' or 'moh'.
+
+    Returns
+    -------
+    counts: Dictionary
+        A dictionary mapping each date, as a 'YYYY-MM-DD' string, to the number of rows first seen on it.
+
+    """
+
+    cursor = connection.execute("""SELECT substr(first_seen, 1, 10) AS day, count(*) FROM (SELECT min(first_seen) AS first_seen FROM listings WHERE source = ? GROUP BY fingerprint)
+                                   GROUP BY day ORDER BY day""", (source,))
+    return dict(cursor.fetchall())
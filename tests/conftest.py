@@ -0,0 +1,4 @@
+import os, sys
+
+# The modules in src import each other by name, as they do when Covy is run from that folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
@@ -0,0 +1,29 @@
+from changes import find_changes, fingerprint, NEW_STATUS, MODIFIED_STATUS, REMOVED_STATUS
+from records import UcLocation
+
+COLUMNS = list(UcLocation._fields)
+KEY_COLUMNS = ["Location", "Date"]
+
+
+def location(name, date="1 october 2021", time="9:00am - 5:00pm"):
+    return UcLocation(name, date, time, "Close Contact", "2 oct")
+
+
+def test_unchanged_rows_are_not_reported():
+    rows = [location("Library"), location("Gym")]
+    assert find_changes(rows, list(reversed(rows)), KEY_COLUMNS, COLUMNS) == []
+
+
+def test_new_modified_and_removed_rows_are_reported_in_order():
+    previous_rows = [location("Library"), location("Gym"), location("Hall")]
+    current_rows = [location("Library"), location("Gym", time="1:00pm - 2:00pm"), location("Cafe")]
+
+    changes = find_changes(previous_rows, current_rows, KEY_COLUMNS, COLUMNS)
+
+    assert [(change.status, change.row.Location) for change in changes] == [(NEW_STATUS, "Cafe"), (MODIFIED_STATUS, "Gym"), (REMOVED_STATUS, "Hall")]
+    assert changes[1].previous == location("Gym")
+    assert changes[1].row.Time == "1:00pm - 2:00pm"
+
+
+def test_fingerprint_separates_values():
+    assert fingerprint(location("ab", date="c"), ["Location", "Date"]) != fingerprint(location("a", date="bc"), ["Location", "Date"])
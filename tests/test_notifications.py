@@ -0,0 +1,45 @@
+from notifications import coalesce
+from slack import pack_sections, escape_mrkdwn, MAX_MESSAGE_TEXT_LENGTH, MAX_SECTION_TEXT_LENGTH, MAX_SECTIONS_PER_MESSAGE
+
+
+def message(text, sections=None, identifier="Update"):
+    return {"kind": "message", "where_to_post": "#covid_updates", "message_type": "Information", "identifier": identifier, "message": text, "greet": False, "sections": sections or []}
+
+
+def test_pack_sections_stays_within_slack_limits():
+    lines = [f"*New Location:* Place {number} " + "x" * 100 for number in range(5000)]
+    messages = pack_sections(lines)
+
+    assert all(len(sections) <= MAX_SECTIONS_PER_MESSAGE for sections in messages)
+    assert all(len(section["text"]["text"]) <= MAX_SECTION_TEXT_LENGTH for sections in messages for section in sections)
+    assert "\n".join(section["text"]["text"] for sections in messages for section in sections) == "\n".join(lines)
+    # Every message but the last is full
+    assert all(len(sections) == MAX_SECTIONS_PER_MESSAGE for sections in messages[:-1])
+
+
+def test_pack_sections_cuts_short_a_line_that_is_too_long():
+    [[section]] = pack_sections(["x" * (MAX_SECTION_TEXT_LENGTH + 10)])
+    assert len(section["text"]["text"]) == MAX_SECTION_TEXT_LENGTH
+
+
+def test_escape_mrkdwn():
+    assert escape_mrkdwn("<Cafe> & Bar") == "&lt;Cafe&gt; &amp; Bar"
+
+
+def test_coalesce_merges_messages_for_the_same_channel_and_identifier():
+    merged = coalesce([message("a"), message("b"), message("c", identifier="Other")])
+    assert [notification["message"] for notification in merged] == ["a\n\nb", "c"]
+
+
+def test_coalesce_starts_a_new_message_once_the_text_would_not_fit():
+    merged = coalesce([message("a" * (MAX_MESSAGE_TEXT_LENGTH - 10)), message("b" * 20), message("c")])
+    assert [len(notification["message"]) for notification in merged] == [MAX_MESSAGE_TEXT_LENGTH - 10, 23]
+
+
+def test_coalesce_keeps_each_message_above_its_sections_while_they_fit():
+    first, second = pack_sections(["first"])[0], pack_sections(["second"])[0]
+    [merged] = coalesce([message("one", first), message("two", second)])
+    assert [section["text"]["text"] for section in merged["sections"]] == ["first", "two", "second"]
+
+    full = [{"type": "section", "text": {"type": "mrkdwn", "text": "x"}}] * MAX_SECTIONS_PER_MESSAGE
+    assert len(coalesce([message("one", full), message("two", second)])) == 2
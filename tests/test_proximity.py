@@ -0,0 +1,58 @@
+import random
+from proximity import build_index, find_nearby, haversine_km, might_be_near, KM_PER_DEGREE_OF_LATITUDE
+
+POINTS = [(-36.85, 174.76, 10.0), (-43.53, 172.63, 25.0), (-45.87, 170.50, 5.0)]
+
+
+def test_find_nearby_matches_every_pair_within_the_radius():
+    index = build_index(*zip(*POINTS))
+    rng = random.Random(0)
+    latitudes = [rng.uniform(-46.5, -35.0) for _ in range(5000)]
+    longitudes = [rng.uniform(168.0, 178.0) for _ in range(5000)]
+
+    location_indexes, point_indexes, _ = find_nearby(index, latitudes, longitudes)
+
+    expected = {(location, point) for location in range(len(latitudes)) for point, (latitude, longitude, radius_km) in enumerate(POINTS)
+                if haversine_km(latitudes[location], longitudes[location], latitude, longitude) <= radius_km}
+    assert set(zip(location_indexes.tolist(), point_indexes.tolist())) == expected
+
+
+def test_might_be_near_keeps_every_match_and_drops_far_locations():
+    index = build_index(*zip(*POINTS))
+    rng = random.Random(1)
+    for _ in range(2000):
+        latitude, longitude, radius_km = rng.choice(POINTS)
+        location = (latitude + rng.uniform(-0.3, 0.3), longitude + rng.uniform(-0.4, 0.4))
+        if haversine_km(*location, latitude, longitude) <= radius_km:
+            assert might_be_near(index, *location)
+
+    # Wellington lies between the points, but is far from all of them
+    assert not might_be_near(index, -41.29, 174.78)
+
+
+def test_a_location_just_inside_the_radius_to_the_north_is_matched():
+    index = build_index([-36.85], [174.76], [10.0])
+    latitude = -36.85 + 10.0 / KM_PER_DEGREE_OF_LATITUDE * 0.9999
+    assert might_be_near(index, latitude, 174.76)
+    assert len(find_nearby(index, [latitude], [174.76])[0]) == 1
+
+
+def test_an_empty_index_matches_nothing():
+    index = build_index([], [], [])
+    assert not might_be_near(index, -43.53, 172.63)
+    assert len(find_nearby(index, [-43.53], [172.63])[0]) == 0
+
+
+def test_points_of_interest_are_indexed_once_when_first_needed(monkeypatch):
+    import covy
+    monkeypatch.setattr(covy, "POINTS_OF_INTEREST", [])
+    monkeypatch.setattr(covy, "PROXIMITY_INDEX", None)
+    assert covy.get_proximity_index() is None
+
+    for name, (latitude, longitude, radius_km) in zip(["Auckland", "Christchurch", "Dunedin"], POINTS):
+        covy.register_point_of_interest(name, latitude, longitude, radius_km, "#covid_updates")
+    assert covy.PROXIMITY_INDEX is None
+
+    index = covy.get_proximity_index()
+    assert covy.get_proximity_index() is index
+    assert might_be_near(index, -45.87, 170.50) and not might_be_near(index, -41.29, 174.78)
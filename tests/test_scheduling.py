@@ -0,0 +1,16 @@
+import covy
+
+
+def test_next_interval_shortens_after_a_change_and_backs_off_without_one():
+    assert covy.next_interval(600, True) == covy.MIN_MINUTES_BETWEEN_SCRAPING * 60
+    assert covy.next_interval(600, False) == 600 * covy.SCRAPING_BACKOFF_FACTOR
+    assert covy.next_interval(covy.MAX_MINUTES_BETWEEN_SCRAPING * 60, False) == covy.MAX_MINUTES_BETWEEN_SCRAPING * 60
+
+
+def test_next_slot_steps_from_the_last_slot_rather_than_from_now():
+    assert covy.next_slot(100, 60, 130) == 160
+
+
+def test_next_slot_skips_missed_slots_and_is_always_in_the_future():
+    assert covy.next_slot(100, 60, 290) == 340
+    assert covy.next_slot(100, 60, 280) == 340
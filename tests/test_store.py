@@ -0,0 +1,35 @@
+from datetime import date
+from changes import find_changes
+from records import UcLocation
+import store
+
+COLUMNS = list(UcLocation._fields)
+KEY_COLUMNS = ["Location", "Date"]
+LIBRARY = UcLocation("Library", "1 october 2021", "9:00am - 5:00pm", "Close Contact", "2 oct")
+
+
+def scrape(connection, current_rows, seen_at):
+    previous_rows = store.load_current_rows(connection, "uc", UcLocation)
+    store.save_changes(connection, "uc", find_changes(previous_rows, current_rows, KEY_COLUMNS, COLUMNS), COLUMNS, seen_at=seen_at)
+
+
+def test_current_rows_round_trip(tmp_path):
+    connection = store.connect(str(tmp_path / "covy.db"))
+    scrape(connection, [LIBRARY], "2021-10-01T00:00:00+00:00")
+    assert store.load_current_rows(connection, "uc", UcLocation) == [LIBRARY]
+
+    scrape(connection, [], "2021-10-02T00:00:00+00:00")
+    assert store.load_current_rows(connection, "uc", UcLocation) == []
+
+
+def test_a_row_listed_again_keeps_the_gap_in_its_history(tmp_path):
+    connection = store.connect(str(tmp_path / "covy.db"))
+    scrape(connection, [LIBRARY], "2021-10-01T00:00:00+00:00")
+    scrape(connection, [], "2021-10-02T00:00:00+00:00")
+    scrape(connection, [LIBRARY], "2021-10-10T00:00:00+00:00")
+
+    assert store.load_rows_listed_on(connection, "uc", date(2021, 10, 1), UcLocation) == [LIBRARY]
+    assert store.load_rows_listed_on(connection, "uc", date(2021, 10, 5), UcLocation) == []
+    assert store.load_rows_listed_on(connection, "uc", date(2021, 10, 11), UcLocation) == [LIBRARY]
+    assert store.load_current_rows(connection, "uc", UcLocation) == [LIBRARY]
+    assert store.count_new_rows_per_day(connection, "uc") == {"2021-10-01": 1}
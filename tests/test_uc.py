@@ -0,0 +1,38 @@
+import covy
+from changes import Change, NEW_STATUS
+from records import UcLocation
+
+PAGE = """<html><head><meta charset="utf-8"></head><body>
+<h3>Day 1</h3><table><tr><th>Location</th></tr><tr><td>
+Te Ao Mārama Building
+</td><td>1 October 2021</td><td>9:00AM - 5:00PM</td><td>close contact</td><td>2 Oct</td></tr></table>
+<h3>Day 2</h3><table><tr><td>central library</td><td>2 October 2021</td><td>10:00AM - 1:00PM</td><td>casual contact</td><td>3 Oct</td><td>stray cell</td></tr></table>
+</body></html>"""
+
+
+def test_extract_uc_locations_cleans_every_table(monkeypatch):
+    monkeypatch.setattr(covy, "UC_TABLE_CACHE", {})
+    assert covy.extract_uc_locations(PAGE.encode("utf-8")) == [("Te Ao Mārama Building", "1 october 2021", "9:00am - 5:00pm", "Close Contact", "2 oct"),
+                                                               ("Central Library", "2 october 2021", "10:00am - 1:00pm", "Casual Contact", "3 oct")]
+
+
+def test_extract_uc_locations_only_parses_new_tables_and_drops_old_ones(monkeypatch):
+    monkeypatch.setattr(covy, "UC_TABLE_CACHE", {})
+    parsed = []
+    parse_uc_table = covy.parse_uc_table
+    monkeypatch.setattr(covy, "parse_uc_table", lambda table_html: parsed.append(table_html) or parse_uc_table(table_html))
+
+    _ = covy.extract_uc_locations(PAGE.encode("utf-8"))
+    assert len(parsed) == 2
+
+    changed_page = PAGE.replace("central library", "rehua building")
+    rows = covy.extract_uc_locations(changed_page.encode("utf-8"))
+    assert len(parsed) == 3
+    assert rows[1][0] == "Rehua Building"
+    assert len(covy.UC_TABLE_CACHE) == 2
+
+
+def test_render_uc_changes_lists_the_latest_date_first():
+    changes = [Change(NEW_STATUS, UcLocation("Library", date, "9:00am - 5:00pm", "Close Contact", "2 oct"), None) for date in ("30 october 2021", "9 october 2021", "friday 1 november 2021")]
+    [[section]] = covy.render_uc_changes(changes)
+    assert [line.split(" on ")[1].split(",")[0] for line in section["text"]["text"].split("\n")] == ["friday 1 november 2021", "30 october 2021", "9 october 2021"]